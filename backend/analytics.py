@@ -0,0 +1,211 @@
+import pandas as pd
+
+from forecaster import upload_month_sales
+from upload_store import UploadStore, load_partials
+from sketches import merge_sketches
+
+# ------------------------------
+# Config
+# ------------------------------
+DEFAULT_MONTHS = 6
+VELOCITY_MONTHS = 3
+TOP_N = 5
+DAYS_PER_MONTH = 30.4
+
+def month_window(last_month, months):
+    # The `months` calendar months ending at last_month ("YYYY-MM"), oldest first
+    return [str(p) for p in pd.period_range(end=last_month, periods=months, freq="M")]
+
+def _pct_change(current, previous):
+    return round((current - previous) / previous * 100, 1) if previous else None
+
+# ------------------------------
+# Merged History
+# ------------------------------
+class SalesHistory:
+    # Every stored upload already carries per-month partials (product
+    # quantities, customer purchase counts) and each product's latest stock,
+    # so a user's whole history is merged from the aggregate store in
+    # O(months x keys) without reading a single upload again.
+    def __init__(self, entries, folder=None):
+        self.folder = folder
+        self.entries = entries
+        self.products = {}     # month -> {product: qty}
+        self.customers = {}    # month -> {customer: purchases}
+        self.stock = {}        # product -> {"date", "stock"}
+        self.sketches = []     # (date_range, {"products", "customers"}) per upload
+        for entry in entries:
+            if "error" in entry:
+                continue
+            entry = load_partials(folder, entry)
+            if entry.get("sketches"):
+                self.sketches.append((entry.get("date_range"), entry["sketches"]))
+            for month, sales in upload_month_sales(entry).items():
+                bucket = self.products.setdefault(month, {})
+                for product, qty in sales.items():
+                    bucket[product] = bucket.get(product, 0) + qty
+            for month, counts in (entry.get("monthly_customer_counts") or {}).items():
+                bucket = self.customers.setdefault(month, {})
+                for customer, n in counts.items():
+                    bucket[customer] = bucket.get(customer, 0) + n
+            # Uploads come in upload order, so a later file wins date ties
+            for product, stock in (entry.get("latest_stock") or {}).items():
+                date = stock["date"] or entry["file"][:10]
+                seen = self.stock.get(product)
+                if seen is None or date >= seen["date"]:
+                    self.stock[product] = {"date": date, "stock": stock["stock"]}
+        self.months = sorted(set(self.products) | set(self.customers))
+
+    @classmethod
+    def for_user(cls, folder):
+        return cls(UploadStore(folder).sync(), folder)
+
+    def span(self):
+        # Calendar months from the first month with sales to the last, gaps included
+        if not self.months:
+            return 0
+        first, last = (pd.Period(m, freq="M") for m in (self.months[0], self.months[-1]))
+        return (last - first).n + 1
+
+    def window(self, months=DEFAULT_MONTHS):
+        # Months with sales inside the last `months` calendar months
+        if not self.months:
+            return []
+        wanted = set(month_window(self.months[-1], months))
+        return [m for m in self.months if m in wanted]
+
+    def calendar(self, months=DEFAULT_MONTHS):
+        # Every calendar month of the window, with or without sales, from the
+        # first month with sales at the earliest
+        if not self.months:
+            return []
+        return month_window(self.months[-1], min(months, self.span()))
+
+    def _product_totals(self, months):
+        totals = {}
+        for month in months:
+            for product, qty in self.products.get(month, {}).items():
+                totals[product] = totals.get(product, 0) + qty
+        return totals
+
+    # ------------------------------
+    # Views
+    # ------------------------------
+    def top_products(self, months=DEFAULT_MONTHS, n=TOP_N):
+        window = self.window(months)
+        totals = self._product_totals(window)
+        # Lists rather than dicts, so the ranking survives JSON key sorting
+        top = sorted(totals.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+        return {"months": window, "top_products": [{"product": p, "quantity": q} for p, q in top]}
+
+    def growth(self, months=DEFAULT_MONTHS, n=TOP_N):
+        # Month-over-month change of total quantity, plus the products that
+        # moved most between the last two months in the window. Months without
+        # sales count as 0, so a gap is not compared as if it were adjacent.
+        window = self.calendar(months)
+        totals = [sum(self.products.get(m, {}).values()) for m in window]
+        trend = [
+            {"month": m, "quantity": q, "change_pct": _pct_change(q, totals[i - 1]) if i else None}
+            for i, (m, q) in enumerate(zip(window, totals))
+        ]
+        movers = {}
+        if len(window) >= 2:
+            last, prev = self.products.get(window[-1], {}), self.products.get(window[-2], {})
+            changes = {p: last.get(p, 0) - prev.get(p, 0) for p in set(last) | set(prev)}
+            ranked = sorted(changes.items(), key=lambda kv: (-kv[1], kv[0]))
+            movers = {
+                "rising": [{"product": p, "change": c} for p, c in ranked[:n] if c > 0],
+                "falling": [{"product": p, "change": c} for p, c in reversed(ranked[-n:]) if c < 0],
+            }
+        return {"months": window, "trend": trend, "movers": movers}
+
+    def stock_velocity(self, months=VELOCITY_MONTHS):
+        # Average units sold per day over the window, and how many days the
+        # latest known stock lasts at that pace (None when nothing sells).
+        # Days span the whole calendar window, months without sales included.
+        window = self.calendar(months)
+        totals = self._product_totals(window)
+        days = len(window) * DAYS_PER_MONTH
+        result = []
+        for product, stock in self.stock.items():
+            per_day = totals.get(product, 0) / days if days else 0.0
+            result.append({
+                "product": product,
+                "stock": stock["stock"],
+                "as_of": stock["date"],
+                "units_per_day": round(per_day, 2),
+                "days_of_cover": round(stock["stock"] / per_day, 1) if per_day else None,
+            })
+        result.sort(key=lambda r: (r["days_of_cover"] is None, r["days_of_cover"] or 0, r["product"]))
+        return {"months": window, "products": result}
+
+    def retention(self, months=DEFAULT_MONTHS):
+        # Per month: active customers, how many also bought the month before
+        # (returning), and how many had never bought before (new)
+        seen, previous, rows = set(), set(), []
+        wanted = set(self.window(months))
+        for month in self.months:
+            active = set(self.customers.get(month, {}))
+            if month in wanted:
+                returning = len(active & previous)
+                rows.append({
+                    "month": month,
+                    "active": len(active),
+                    "returning": returning,
+                    "new": len(active - seen),
+                    "retention_pct": round(returning / len(previous) * 100, 1) if previous else None,
+                })
+            seen |= active
+            previous = active
+        return {"months": [r["month"] for r in rows], "retention": rows}
+
+    def heavy_hitters(self, months=DEFAULT_MONTHS, n=TOP_N):
+        # Top products and customers from the merged per-upload sketches of
+        # every upload that has sales in the window (whole uploads: sketches
+        # are not split by month). Each estimate is at most error_bound below
+        # the true total, and never above it.
+        window = self.window(months)
+        first, last = (window[0], window[-1]) if window else (None, None)
+        picked = [
+            sketches for date_range, sketches in self.sketches
+            if first is None or date_range is None
+            or (date_range[1][:7] >= first and date_range[0][:7] <= last)
+        ]
+        result = {"months": window, "uploads": len(picked)}
+        for field, key in (("products", "product"), ("customers", "customer")):
+            merged = merge_sketches(s.get(field) for s in picked)
+            result[field] = {
+                "top": [{key: k, "count": v} for k, v in merged.top(n).items()],
+                "total": merged.total,
+                "error_bound": merged.error_bound,
+            }
+        return result
+
+    def customer_overlap(self, months=DEFAULT_MONTHS):
+        # overlap[i][j]: customers who bought in both window months i and j,
+        # joined on the shop's integer customer codes (see symbols.py)
+        from symbols import CodedHistory
+
+        if self.folder is None:
+            raise ValueError("customer overlap needs the user's folder")
+        coded = CodedHistory(self.folder, self.entries)
+        window = [m for m in self.window(months) if m in coded.month_customers]
+        overlap = coded.customer_overlap(window)
+        return {"months": window, "active": [row[i] for i, row in enumerate(overlap)], "overlap": overlap}
+
+    def summary(self, months=DEFAULT_MONTHS):
+        return {
+            "top_products": self.top_products(months)["top_products"],
+            "growth": self.growth(months),
+            "stock_velocity": self.stock_velocity(min(months, VELOCITY_MONTHS))["products"],
+            "retention": self.retention(months)["retention"],
+        }
+
+VIEWS = {
+    "top-products": SalesHistory.top_products,
+    "growth": SalesHistory.growth,
+    "stock-velocity": SalesHistory.stock_velocity,
+    "retention": SalesHistory.retention,
+    "heavy-hitters": SalesHistory.heavy_hitters,
+    "customer-overlap": SalesHistory.customer_overlap,
+}
@@ -1,11 +1,15 @@
-from flask import Flask, request, jsonify
-import pandas as pd
-from twilio.rest import Client
-from biz_insights import generate_insights, generate_personalized_advice
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify
+from biz_insights import generate_personalized_advice
+from streaming import stream_insights
+from whatsapp_queue import DeliveryWorker, FakeTwilioClient
+from insight_cache import InsightCache, upload_key
+import metrics
 import os
+import time
 from dotenv import load_dotenv
 
-app = Flask(__name__)
+# Routes live on a blueprint; create_app() wires them to per-process state
+api = Blueprint("api", __name__)
 
 # ---------------------------------------
 # Load Twilio Credentials from .env
@@ -16,54 +20,339 @@ TWILIO_SID = os.getenv("TWILIO_SID")
 TWILIO_AUTH = os.getenv("TWILIO_AUTH_TOKEN")
 FROM_NUMBER = os.getenv("FROM_NUMBER", "whatsapp:+14155238886")
 
-if not TWILIO_SID or not TWILIO_AUTH:
-    raise ValueError("❌ TWILIO_SID or TWILIO_AUTH_TOKEN is missing in .env file")
+def make_twilio_client():
+    if os.getenv("TWILIO_FAKE") == "1":
+        return FakeTwilioClient()
+    if not TWILIO_SID or not TWILIO_AUTH:
+        raise ValueError("❌ TWILIO_SID or TWILIO_AUTH_TOKEN is missing in .env file")
+    from twilio.rest import Client
 
-client = Client(TWILIO_SID, TWILIO_AUTH)
+    return Client(TWILIO_SID, TWILIO_AUTH)
+
+# ---------------------------------------
+# App Factory
+# ---------------------------------------
+def create_app(client=None, start_workers=True):
+    # start_workers=False is for pre-fork servers: threads do not survive
+    # fork(), so each worker process starts its own (see gunicorn.conf.py).
+    app = Flask(__name__)
+    app.register_blueprint(api)
+
+    # Messages are queued durably and sent by background workers with
+    # rate limiting and retries, so requests never wait on Twilio.
+    app.extensions["whatsapp"] = DeliveryWorker(client or make_twilio_client(), FROM_NUMBER)
+
+    # Insights for identical uploads (same bytes, same cleaner) are shared
+    # by /upload and /smart-insight
+    app.extensions["insight_cache"] = InsightCache()
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+    if start_workers:
+        app.extensions["whatsapp"].start()
+    return app
+
+# ---------------------------------------
+# Request metrics and profiling
+# ---------------------------------------
+# ?profile=1 (or an X-Profile: 1 header) adds a per-stage breakdown to the
+# JSON response and a Server-Timing header; without it only counters and
+# histograms are updated.
+def _start_request():
+    g.request_start = time.perf_counter()
+    if request.args.get("profile") == "1" or request.headers.get("X-Profile") == "1":
+        g.profile_token = metrics.start_profile()
+
+def _finish_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    elapsed = time.perf_counter() - g.request_start
+    metrics.observe("http_request_seconds", elapsed, endpoint=endpoint)
+    metrics.inc("http_requests_total", endpoint=endpoint, status=response.status_code)
+
+    token = g.pop("profile_token", None)
+    if token is not None:
+        profile = metrics.stop_profile(token)
+        profile["total_secs"] = round(elapsed, 6)
+        response.headers["Server-Timing"] = metrics.server_timing(profile)
+        body = response.get_json(silent=True) if response.is_json else None
+        if isinstance(body, dict):
+            body["profile"] = profile
+            response.set_data(current_app.json.dumps(body))
+    return response
+
+def error_response(e, status=500):
+    # Errors keep their message but also say what kind of failure it was
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.inc("http_errors_total", endpoint=endpoint, error=type(e).__name__)
+    return jsonify({"error": str(e), "error_type": type(e).__name__}), status
+
+def whatsapp():
+    return current_app.extensions["whatsapp"]
+
+def insight_cache():
+    return current_app.extensions["insight_cache"]
+
+def _upload_size(stream):
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+def analyse_upload(file):
+    metrics.inc("upload_bytes_total", _upload_size(file.stream))
+
+    def compute():
+        insights = stream_insights(file.stream)
+        return {"insights": insights, "smart_suggestion": generate_personalized_advice(insights)}
+    with metrics.stage("hash"):
+        key = upload_key(file.stream)
+    return insight_cache().get_or_compute(key, compute)
 
 # ---------------------------------------
 # Health Check
 # ---------------------------------------
-@app.route('/')
+@api.route('/')
 def home():
     return " IntelliVyapaar Flask API is running."
 
 # ---------------------------------------
 # Upload CSV and return insights only
 # ---------------------------------------
-@app.route('/upload', methods=['POST'])
+@api.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
     try:
-        df = pd.read_csv(request.files['file'])
-        insights = generate_insights(df)
-        return jsonify(insights)
+        result = analyse_upload(request.files['file'])
+        return jsonify(result["insights"])
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
 
 # ---------------------------------------
 # Upload CSV and return insights + suggestion
 # ---------------------------------------
-@app.route('/smart-insight', methods=['POST'])
+@api.route('/smart-insight', methods=['POST'])
 def smart_insight():
     if 'file' not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
     try:
-        df = pd.read_csv(request.files['file'])
-        insights = generate_insights(df)
-        suggestion = generate_personalized_advice(insights)
+        result = analyse_upload(request.files['file'])
         return jsonify({
-            "insights": insights,
-            "smart_suggestion": suggestion
+            "insights": result["insights"],
+            "smart_suggestion": result["smart_suggestion"]
         })
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
 
 # ---------------------------------------
-# Send WhatsApp Message via Twilio
+# Upload CSV and return insights per store / salesperson / promotion
 # ---------------------------------------
-@app.route('/send-whatsapp', methods=['POST'])
+@api.route('/segment-insights', methods=['POST'])
+def segment_insights():
+    from segments import SEGMENT_DIMENSIONS, segment_insights as run_segments
+    import pandas as pd
+
+    if 'file' not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+    by = request.form.get('by', request.args.get('by', 'store_location'))
+    if by not in SEGMENT_DIMENSIONS:
+        return jsonify({"error": f"'by' must be one of {list(SEGMENT_DIMENSIONS)}"}), 400
+    try:
+        file = request.files['file']
+        metrics.inc("upload_bytes_total", _upload_size(file.stream))
+        with metrics.stage("read_csv"):
+            df = pd.read_csv(file.stream)
+        return jsonify(run_segments(df, by))
+    except ValueError as e:
+        return error_response(e, 400)
+    except Exception as e:
+        return error_response(e)
+
+# ---------------------------------------
+# Upload many CSVs (or zip archives) and save them for a user
+# ---------------------------------------
+@api.route('/batch-upload', methods=['POST'])
+def batch_upload():
+    from batch_upload import BatchError, process_batch
+    from upload_store import user_folder, valid_phone
+
+    phone = request.form.get('phone', '')
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not valid_phone(phone):
+        return jsonify({"error": "Missing or invalid phone"}), 400
+    if not files:
+        return jsonify({"error": "No file uploaded"}), 400
+    try:
+        metrics.inc("upload_bytes_total", sum(_upload_size(f.stream) for f in files))
+        result = process_batch([(f.filename or "upload.csv", f.stream) for f in files], user_folder(phone))
+        return jsonify(result), 200 if result["saved"] else 422
+    except BatchError as e:
+        return error_response(e, 400)
+    except Exception as e:
+        return error_response(e)
+
+# ---------------------------------------
+# Live POS events: one sale, a JSON array, or JSON lines
+# ---------------------------------------
+@api.route('/events/<phone>', methods=['POST'])
+def ingest_events(phone):
+    from live_events import MAX_EVENTS_PER_REQUEST, live_store
+    from upload_store import user_folder, valid_phone
+    import json
+
+    if not valid_phone(phone):
+        return jsonify({"error": "Missing or invalid phone"}), 400
+    parse_errors = []
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if body is None:
+            return jsonify({"error": "Invalid JSON body"}), 400
+        events = body if isinstance(body, list) else [body]
+    else:
+        events = []
+        for i, line in enumerate(request.get_data(as_text=True).splitlines()):
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError as e:
+                parse_errors.append({"line": i + 1, "error": str(e)})
+    if not events and not parse_errors:
+        return jsonify({"error": "No events"}), 400
+    if len(events) > MAX_EVENTS_PER_REQUEST:
+        return jsonify({"error": f"At most {MAX_EVENTS_PER_REQUEST} events per request"}), 413
+    try:
+        result = live_store(user_folder(phone)).ingest(events)
+        result["rejected"] = parse_errors + result["rejected"]
+        return jsonify(result), 200 if result["accepted"] else 422
+    except Exception as e:
+        return error_response(e)
+
+@api.route('/live-insights/<phone>', methods=['GET'])
+def live_insights(phone):
+    from live_events import has_events, live_store
+    from upload_store import user_folder, valid_phone
+
+    folder = user_folder(phone)
+    if not valid_phone(phone) or not has_events(folder):
+        return jsonify({"error": "No events for this user"}), 404
+    try:
+        return jsonify(live_store(folder).insights())
+    except Exception as e:
+        return error_response(e)
+
+# ---------------------------------------
+# Insight cache counters
+# ---------------------------------------
+@api.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify(insight_cache().stats())
+
+# ---------------------------------------
+# Prometheus metrics (per worker process)
+# ---------------------------------------
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    cache = insight_cache().stats()
+    gauges = {
+        "insight_cache_entries": ("Entries in the insight cache", cache["entries"]),
+        "insight_cache_hits": ("Insight cache hits since start", cache["hits"]),
+        "insight_cache_misses": ("Insight cache misses since start", cache["misses"]),
+        "insight_cache_evictions": ("Insight cache evictions since start", cache["evictions"]),
+    }
+    try:
+        counts = whatsapp().queue.counts()
+        gauges["whatsapp_queue_messages"] = ("WhatsApp messages by queue status",
+                                             {(("status", k),): v for k, v in counts.items()})
+    except Exception:
+        pass
+    return Response(metrics.REGISTRY.render(gauges), mimetype="text/plain; version=0.0.4")
+
+# ---------------------------------------
+# Chart PNGs for a stored upload (raw bytes, no base64)
+# ---------------------------------------
+@api.route('/charts/<phone>/<filename>/<kind>.png', methods=['GET'])
+def chart_png(phone, filename, kind):
+    from charts import CHARTS, render_chart
+    from upload_store import UploadStore, user_folder, valid_phone
+
+    folder = user_folder(phone)
+    if kind not in CHARTS or not valid_phone(phone) or not os.path.isdir(folder):
+        return jsonify({"error": "Unknown chart or user"}), 404
+    agg = UploadStore(folder).aggregates(filename)
+    png = render_chart(kind, agg) if agg is not None else None
+    if png is None:
+        return jsonify({"error": "No chart data for this upload"}), 404
+    return Response(png, mimetype="image/png", headers={"Cache-Control": "private, max-age=3600"})
+
+# ---------------------------------------
+# Rolling analytics across all of a user's uploads
+# ---------------------------------------
+@api.route('/analytics/<phone>', defaults={'view': None}, methods=['GET'])
+@api.route('/analytics/<phone>/<view>', methods=['GET'])
+def analytics(phone, view):
+    from analytics import DEFAULT_MONTHS, VIEWS, SalesHistory
+    from upload_store import user_folder, valid_phone
+
+    if not valid_phone(phone) or not os.path.isdir(user_folder(phone)):
+        return jsonify({"error": "Unknown view or user"}), 404
+    folder = user_folder(phone)
+    if view is not None and view not in VIEWS:
+        return jsonify({"error": "Unknown view or user"}), 404
+    months = request.args.get('months', DEFAULT_MONTHS, type=int)
+    if months < 1:
+        return jsonify({"error": "months must be a positive integer"}), 400
+    try:
+        history = SalesHistory.for_user(folder)
+        result = history.summary(months) if view is None else VIEWS[view](history, months)
+        return jsonify(result)
+    except Exception as e:
+        return error_response(e)
+
+# ---------------------------------------
+# Next-month forecasts for the top products, with their RMSE
+# ---------------------------------------
+@api.route('/forecast/<phone>', methods=['GET'])
+def forecast(phone):
+    from biz_insights import forecast_top_products
+    from upload_store import user_folder, valid_phone
+
+    folder = user_folder(phone)
+    if not valid_phone(phone) or not os.path.isdir(folder):
+        return jsonify({"error": "Unknown user"}), 404
+    result = forecast_top_products(folder)
+    if "error" in result:
+        return jsonify(result), 500
+    return jsonify([{"product": p, **f} for p, f in result.items()])
+
+# ---------------------------------------
+# Customers who bought X also bought Y, across all of a user's uploads
+# ---------------------------------------
+@api.route('/recommendations/<phone>', methods=['GET'])
+def recommendations(phone):
+    from copurchase import ALSO_BOUGHT_N, CoPurchaseIndex
+    from upload_store import user_folder, valid_phone
+
+    folder = user_folder(phone)
+    if not valid_phone(phone) or not os.path.isdir(folder):
+        return jsonify({"error": "Unknown user"}), 404
+    n = request.args.get('n', ALSO_BOUGHT_N, type=int)
+    if n < 1:
+        return jsonify({"error": "n must be a positive integer"}), 400
+    try:
+        index = CoPurchaseIndex.for_user(folder)
+        product = request.args.get('product')
+        if product:
+            return jsonify({"product": product, "also_bought": index.also_bought(product, n)})
+        return jsonify(index.recommendations(index.top_products(5), n))
+    except Exception as e:
+        return error_response(e)
+
+# ---------------------------------------
+# Queue WhatsApp Message via Twilio
+# ---------------------------------------
+@api.route('/send-whatsapp', methods=['POST'])
 def send_whatsapp():
     data = request.json
     phone = data.get('phone')
@@ -73,18 +362,21 @@ def send_whatsapp():
         return jsonify({"status": "error", "message": "Missing phone or message"}), 400
 
     try:
-        client.messages.create(
-            body=message,
-            from_=FROM_NUMBER,
-            to=f"whatsapp:{phone}"
-        )
-        return jsonify({"status": "success", "message": "Message sent successfully"}), 200
+        message_id = whatsapp().queue.enqueue(phone, message)
+        return jsonify({"status": "queued", "message_id": message_id}), 202
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@api.route('/whatsapp-status/<message_id>', methods=['GET'])
+def whatsapp_status(message_id):
+    status = whatsapp().queue.get(message_id)
+    if status is None:
+        return jsonify({"status": "error", "message": "Unknown message_id"}), 404
+    return jsonify(status)
+
 # ---------------------------------------
 # Run the Flask App
 # ---------------------------------------
 if __name__ == '__main__':
-    app.run(debug=True, use_reloader=False)
+    create_app().run(debug=True, use_reloader=False)
 
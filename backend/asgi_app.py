@@ -0,0 +1,244 @@
+import io
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from app import FROM_NUMBER, TWILIO_AUTH, TWILIO_SID
+from batch_upload import pool_context
+from biz_insights import generate_personalized_advice
+from insight_cache import InsightCache, upload_key
+from streaming import stream_insights
+from whatsapp_queue import RATE_PER_SEC, AsyncDeliveryWorker, FakeTwilioClient, RateLimiter
+import metrics
+
+# ---------------------------------------
+# Async serving mode for the same API
+#   WEB_CONCURRENCY=2 uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+# CPU-bound analysis runs on a bounded process pool, Twilio sends are
+# awaited on the event loop, and uploads are admitted only while there is
+# room: past the queue depth or a user's concurrency limit the answer is an
+# immediate 429, so health checks and small shops are never stuck behind a
+# burst of huge CSVs.
+# ---------------------------------------
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", os.cpu_count() or 2))
+MAX_PENDING = int(os.getenv("MAX_PENDING_ANALYSES", str(4 * ANALYSIS_WORKERS)))
+PER_USER_LIMIT = int(os.getenv("PER_USER_ANALYSES", "2"))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "60"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 << 20)))
+RETRY_AFTER = "5"
+# uvicorn's --workers defaults to WEB_CONCURRENCY; each worker process sends
+# its share of WHATSAPP_RATE_PER_SEC, as gunicorn's post_fork does
+SERVER_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+def make_async_twilio_client():
+    if os.getenv("TWILIO_FAKE") == "1":
+        return FakeTwilioClient()
+    if not TWILIO_SID or not TWILIO_AUTH:
+        raise ValueError("❌ TWILIO_SID or TWILIO_AUTH_TOKEN is missing in .env file")
+    from twilio.rest import Client
+    from twilio.http.async_http_client import AsyncTwilioHttpClient
+
+    return Client(TWILIO_SID, TWILIO_AUTH, http_client=AsyncTwilioHttpClient())
+
+# ---------------------------------------
+# CPU work (runs in a pool process)
+# ---------------------------------------
+def analyse_bytes(data):
+    insights = stream_insights(io.BytesIO(data))
+    return {"insights": insights, "smart_suggestion": generate_personalized_advice(insights)}
+
+# ---------------------------------------
+# Admission control
+# ---------------------------------------
+class Overloaded(Exception):
+    pass
+
+class Admission:
+    # Counts analyses that hold a slot, overall and per user. Only touched
+    # from the event loop thread, so no locking is needed. A slot is freed
+    # when the pool job really ends, even if its request already timed out.
+    def __init__(self, max_pending=MAX_PENDING, per_user=PER_USER_LIMIT):
+        self.max_pending = max_pending
+        self.per_user = per_user
+        self.pending = 0
+        self.by_user = {}
+
+    def acquire(self, user):
+        if self.pending >= self.max_pending:
+            raise Overloaded("Server is busy, retry shortly")
+        if self.by_user.get(user, 0) >= self.per_user:
+            raise Overloaded("Too many analyses in progress for this user")
+        self.pending += 1
+        self.by_user[user] = self.by_user.get(user, 0) + 1
+
+    def release(self, user):
+        self.pending -= 1
+        left = self.by_user.pop(user) - 1
+        if left:
+            self.by_user[user] = left
+
+def _user_of(request):
+    # The shop's phone when the client sends one, else the caller's address
+    return (request.headers.get("X-User-Phone") or request.query_params.get("phone")
+            or (request.client.host if request.client else "unknown"))
+
+def error_response(request, e, status=500, headers=None):
+    route = request.scope.get("route")
+    metrics.inc("http_errors_total", endpoint=route.path if route else "unmatched", error=type(e).__name__)
+    return JSONResponse({"error": str(e), "error_type": type(e).__name__}, status, headers=headers)
+
+async def analyse_upload(request):
+    # -> (result, None) or (None, error response)
+    length = int(request.headers.get("content-length") or 0)
+    if length > MAX_UPLOAD_BYTES:
+        return None, JSONResponse({"error": f"Upload is larger than {MAX_UPLOAD_BYTES} bytes"}, 413)
+
+    state = request.app.state
+    user = _user_of(request)
+    try:
+        state.admission.acquire(user)
+    except Overloaded as e:
+        return None, error_response(request, e, 429, {"Retry-After": RETRY_AFTER})
+
+    job = None
+    try:
+        form = await request.form()
+        file = form.get("file")
+        if file is None or isinstance(file, str):
+            return None, JSONResponse({"error": "No file uploaded"}, 400)
+        data = await file.read()
+        metrics.inc("upload_bytes_total", len(data))
+
+        key = await asyncio.to_thread(upload_key, io.BytesIO(data))
+        result = state.insight_cache.get(key)
+        if result is not None:
+            return result, None
+
+        loop = asyncio.get_running_loop()
+        job = state.pool.submit(analyse_bytes, data)
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(state.admission.release, user))
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(job), REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            job.cancel()    # drops it if still queued; a running job finishes unobserved
+            return None, error_response(request, TimeoutError(f"Analysis took longer than {REQUEST_TIMEOUT}s"), 504)
+        state.insight_cache.put(key, result)
+        return result, None
+    except Exception as e:
+        return None, error_response(request, e)
+    finally:
+        if job is None:
+            state.admission.release(user)
+
+# ---------------------------------------
+# Routes (same paths and payloads as app.py)
+# ---------------------------------------
+async def home(request):
+    return PlainTextResponse(" IntelliVyapaar Flask API is running.")
+
+async def upload_file(request):
+    result, error = await analyse_upload(request)
+    return error or JSONResponse(result["insights"])
+
+async def smart_insight(request):
+    result, error = await analyse_upload(request)
+    return error or JSONResponse({"insights": result["insights"],
+                                  "smart_suggestion": result["smart_suggestion"]})
+
+async def send_whatsapp(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    data = data if isinstance(data, dict) else {}
+    phone, message = data.get("phone"), data.get("message")
+    if not phone or not message:
+        return JSONResponse({"status": "error", "message": "Missing phone or message"}, 400)
+    try:
+        queue = request.app.state.whatsapp.queue
+        message_id = await asyncio.to_thread(queue.enqueue, phone, message)
+        return JSONResponse({"status": "queued", "message_id": message_id}, 202)
+    except Exception as e:
+        return JSONResponse({"status": "error", "message": str(e)}, 500)
+
+async def whatsapp_status(request):
+    queue = request.app.state.whatsapp.queue
+    status = await asyncio.to_thread(queue.get, request.path_params["message_id"])
+    if status is None:
+        return JSONResponse({"status": "error", "message": "Unknown message_id"}, 404)
+    return JSONResponse(status)
+
+async def prometheus_metrics(request):
+    state = request.app.state
+    cache = state.insight_cache.stats()
+    gauges = {
+        "insight_cache_entries": ("Entries in the insight cache", cache["entries"]),
+        "analyses_pending": ("Uploads admitted and not yet analysed", state.admission.pending),
+        "analyses_capacity": ("Most uploads admitted at once", state.admission.max_pending),
+    }
+    return Response(metrics.REGISTRY.render(gauges), media_type="text/plain; version=0.0.4")
+
+# ---------------------------------------
+# Request metrics
+# ---------------------------------------
+class RequestMetrics:
+    # Pure ASGI middleware: latency and status per route template
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start, status = time.perf_counter(), 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            endpoint = route.path if route else "unmatched"
+            metrics.observe("http_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+            metrics.inc("http_requests_total", endpoint=endpoint, status=status)
+
+# ---------------------------------------
+# App Factory
+# ---------------------------------------
+def create_app(client=None, workers=ANALYSIS_WORKERS, start_workers=True):
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.pool = ProcessPoolExecutor(max_workers=workers, mp_context=pool_context())
+        app.state.admission = Admission()
+        app.state.insight_cache = InsightCache()
+        app.state.whatsapp = AsyncDeliveryWorker(client or make_async_twilio_client(), FROM_NUMBER,
+                                                 limiter=RateLimiter(RATE_PER_SEC / SERVER_WORKERS))
+        if start_workers:
+            app.state.whatsapp.start()
+        try:
+            yield
+        finally:
+            await app.state.whatsapp.stop_async()
+            app.state.pool.shutdown(wait=False, cancel_futures=True)
+
+    app = Starlette(routes=[
+        Route("/", home),
+        Route("/upload", upload_file, methods=["POST"]),
+        Route("/smart-insight", smart_insight, methods=["POST"]),
+        Route("/send-whatsapp", send_whatsapp, methods=["POST"]),
+        Route("/whatsapp-status/{message_id}", whatsapp_status),
+        Route("/metrics", prometheus_metrics),
+    ], lifespan=lifespan)
+    app.add_middleware(RequestMetrics)
+    return app
+
+app = create_app()
@@ -0,0 +1,142 @@
+import numpy as np
+
+# ------------------------------
+# Batched exponential smoothing
+# ------------------------------
+# Every product is one row of a (products x months) matrix. Series may have
+# different lengths: they are left-aligned and `lengths` says how many months
+# each row has. For a fixed smoothing parameter the one-step errors are linear
+# in the initial state, so the best initial level (and trend, for Holt) has a
+# closed form. The smoothing parameters are then chosen by a coarse grid over
+# [0, 1] followed by a finer grid around each row's best value, all rows at once.
+COARSE_STEPS = 21
+FINE_STEPS = 21
+HOLT_COARSE_STEPS = 11    # per parameter, so 11 x 11 (alpha, beta) pairs
+HOLT_FINE_STEPS = 9
+CHUNK_ROWS = 2048
+
+def series_matrix(series_list):
+    lengths = np.array([len(s) for s in series_list], dtype=np.int64)
+    Y = np.zeros((len(series_list), int(lengths.max()) if len(lengths) else 0))
+    for i, s in enumerate(series_list):
+        Y[i, :len(s)] = s
+    return Y, lengths
+
+def _chunks(n):
+    for start in range(0, n, CHUNK_ROWS):
+        yield slice(start, min(start + CHUNK_ROWS, n))
+
+def _refine(best, coarse_step):
+    # (FINE_STEPS, rows) candidates around each row's coarse optimum
+    offsets = np.linspace(-coarse_step, coarse_step, FINE_STEPS)[:, None]
+    return np.clip(best[None, :] + offsets, 0.0, 1.0)
+
+# ------------------------------
+# Simple exponential smoothing
+# ------------------------------
+def _ses_grid(Y, lengths, alphas):
+    # alphas: (G, rows). Returns sse, l0 and final level, each (G, rows).
+    a = alphas
+    A = np.zeros_like(a)        # level contribution of y with l0 = 0
+    w = np.ones_like(a)         # weight of l0 in the current level
+    s_cc = np.zeros_like(a)
+    s_wc = np.zeros_like(a)
+    s_ww = np.zeros_like(a)
+    for t in range(Y.shape[1]):
+        valid = (t < lengths)[None, :]
+        y = Y[None, :, t]
+        c = y - A
+        s_cc += np.where(valid, c * c, 0.0)
+        s_wc += np.where(valid, w * c, 0.0)
+        s_ww += np.where(valid, w * w, 0.0)
+        A = np.where(valid, a * y + (1 - a) * A, A)
+        w = np.where(valid, (1 - a) * w, w)
+    l0 = s_wc / s_ww
+    sse = np.maximum(s_cc - s_wc * l0, 0.0)
+    return sse, l0, A + w * l0
+
+def _pick(sse, *arrays):
+    idx = np.argmin(sse, axis=0)
+    cols = np.arange(sse.shape[1])
+    return [arr[idx, cols] for arr in (sse,) + arrays]
+
+def fit_ses(Y, lengths):
+    Y = np.asarray(Y, dtype=float)
+    n = Y.shape[0]
+    out = {k: np.empty(n) for k in ("alpha", "l0", "level", "sse")}
+    coarse = np.linspace(0.0, 1.0, COARSE_STEPS)
+    for rows in _chunks(n):
+        y, ln = Y[rows], lengths[rows]
+        grid = np.repeat(coarse[:, None], y.shape[0], axis=1)
+        sse, l0, level = _ses_grid(y, ln, grid)
+        _, best, _, _ = _pick(sse, grid, l0, level)
+        grid = _refine(best, coarse[1] - coarse[0])
+        sse, l0, level = _ses_grid(y, ln, grid)
+        sse, alpha, l0, level = _pick(sse, grid, l0, level)
+        for k, v in zip(("alpha", "l0", "level", "sse"), (alpha, l0, level, sse)):
+            out[k][rows] = v
+    out["forecast"] = out["level"]
+    out["rmse"] = np.sqrt(out["sse"] / np.maximum(lengths, 1))
+    return out
+
+# ------------------------------
+# Holt (additive trend) smoothing
+# ------------------------------
+def _holt_grid(Y, lengths, alphas, betas):
+    # Level and trend are tracked as y-part + l0-coefficient + b0-coefficient.
+    a, b = alphas, betas
+    Ly, Ll, Lb = np.zeros_like(a), np.ones_like(a), np.zeros_like(a)
+    By, Bl, Bb = np.zeros_like(a), np.zeros_like(a), np.ones_like(a)
+    s = {k: np.zeros_like(a) for k in ("cc", "lc", "bc", "ll", "lb", "bb")}
+    for t in range(Y.shape[1]):
+        valid = (t < lengths)[None, :]
+        y = Y[None, :, t]
+        # one-step prediction = level + trend
+        c, pl, pb = y - (Ly + By), Ll + Bl, Lb + Bb
+        for key, val in (("cc", c * c), ("lc", pl * c), ("bc", pb * c),
+                         ("ll", pl * pl), ("lb", pl * pb), ("bb", pb * pb)):
+            s[key] += np.where(valid, val, 0.0)
+        nLy, nLl, nLb = a * y + (1 - a) * (Ly + By), (1 - a) * pl, (1 - a) * pb
+        nBy = b * (nLy - Ly) + (1 - b) * By
+        nBl = b * (nLl - Ll) + (1 - b) * Bl
+        nBb = b * (nLb - Lb) + (1 - b) * Bb
+        Ly, Ll, Lb = (np.where(valid, new, old) for new, old in ((nLy, Ly), (nLl, Ll), (nLb, Lb)))
+        By, Bl, Bb = (np.where(valid, new, old) for new, old in ((nBy, By), (nBl, Bl), (nBb, Bb)))
+
+    det = s["ll"] * s["bb"] - s["lb"] ** 2
+    ok = np.abs(det) > 1e-9 * np.maximum(s["ll"] * s["bb"], 1e-12)
+    safe = np.where(ok, det, 1.0)
+    l0 = np.where(ok, (s["bb"] * s["lc"] - s["lb"] * s["bc"]) / safe, s["lc"] / s["ll"])
+    b0 = np.where(ok, (s["ll"] * s["bc"] - s["lb"] * s["lc"]) / safe, 0.0)
+    sse = s["cc"] - 2 * (l0 * s["lc"] + b0 * s["bc"]) \
+        + l0 * l0 * s["ll"] + 2 * l0 * b0 * s["lb"] + b0 * b0 * s["bb"]
+    level = Ly + Ll * l0 + Lb * b0
+    trend = By + Bl * l0 + Bb * b0
+    return np.maximum(sse, 0.0), l0, b0, level, trend
+
+def fit_holt(Y, lengths):
+    Y = np.asarray(Y, dtype=float)
+    n = Y.shape[0]
+    keys = ("alpha", "beta", "l0", "b0", "level", "trend", "sse")
+    out = {k: np.empty(n) for k in keys}
+    coarse = np.linspace(0.0, 1.0, HOLT_COARSE_STEPS)
+    ga, gb = (g.ravel() for g in np.meshgrid(coarse, coarse, indexing="ij"))
+    step = coarse[1] - coarse[0]
+    fine = np.linspace(-step, step, HOLT_FINE_STEPS)
+    fa, fb = (g.ravel() for g in np.meshgrid(fine, fine, indexing="ij"))
+    for rows in _chunks(n):
+        y, ln = Y[rows], lengths[rows]
+        m = y.shape[0]
+        A = np.repeat(ga[:, None], m, axis=1)
+        B = np.repeat(gb[:, None], m, axis=1)
+        sse, *_ = _holt_grid(y, ln, A, B)
+        _, best_a, best_b = _pick(sse, A, B)
+        A = np.clip(best_a[None, :] + fa[:, None], 0.0, 1.0)
+        B = np.clip(best_b[None, :] + fb[:, None], 0.0, 1.0)
+        res = _holt_grid(y, ln, A, B)
+        picked = _pick(res[0], A, B, *res[1:])
+        for k, v in zip(("sse", "alpha", "beta", "l0", "b0", "level", "trend"), picked):
+            out[k][rows] = v
+    out["forecast"] = out["level"] + out["trend"]
+    out["rmse"] = np.sqrt(out["sse"] / np.maximum(lengths, 1))
+    return out
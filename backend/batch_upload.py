@@ -0,0 +1,157 @@
+import os
+import uuid
+import shutil
+import zipfile
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from streaming import stream_aggregate
+from upload_store import (UploadStore, UploadWriter, new_upload_name, state_path,
+                          summarize_upload, UPLOAD_FORMAT)
+
+# ------------------------------
+# Config
+# ------------------------------
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", os.cpu_count() or 2))
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "100"))
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(1 << 30)))    # uncompressed, per batch
+COPY_CHUNK = 1 << 20
+
+class BatchError(ValueError):
+    pass
+
+# ------------------------------
+# Staging: uploaded files and zip members -> CSVs on disk
+# ------------------------------
+def _copy_limited(src, dst_path, budget):
+    # Streams src to dst_path in fixed-size chunks; returns bytes written
+    written = 0
+    with open(dst_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(COPY_CHUNK), b""):
+            written += len(chunk)
+            if written > budget:
+                raise BatchError(f"Batch is larger than {MAX_BATCH_BYTES} bytes uncompressed")
+            dst.write(chunk)
+    return written
+
+def stage_files(files, staging_dir):
+    # files: [(name, binary stream)] of CSVs and/or zip archives. Zip members
+    # are extracted one at a time, so memory stays at one copy buffer no
+    # matter how large the archive is. Returns [(source name, staged path)].
+    staged, budget = [], MAX_BATCH_BYTES
+
+    def add(name, stream):
+        nonlocal budget
+        if len(staged) >= MAX_BATCH_FILES:
+            raise BatchError(f"At most {MAX_BATCH_FILES} files per batch")
+        path = os.path.join(staging_dir, f"{len(staged):04d}.csv")
+        budget -= _copy_limited(stream, path, budget)
+        staged.append((name, path))
+
+    for name, stream in files:
+        if name.lower().endswith(".zip"):
+            with zipfile.ZipFile(stream) as archive:
+                members = [
+                    m for m in archive.infolist()
+                    if not m.is_dir() and m.filename.lower().endswith(".csv")
+                    and not m.filename.startswith("__MACOSX/")
+                    and not os.path.basename(m.filename).startswith(".")
+                ]
+                for member in sorted(members, key=lambda m: m.filename):
+                    with archive.open(member) as src:
+                        add(f"{name}/{member.filename}", src)
+        elif name.lower().endswith(".csv"):
+            add(name, stream)
+        else:
+            raise BatchError(f"Unsupported file type: {name}")
+    if not staged:
+        raise BatchError("No CSV files in the batch")
+    return staged
+
+# ------------------------------
+# Worker (runs in a separate process)
+# ------------------------------
+def process_file(csv_path, parquet_path, folder):
+    # Clean, aggregate and write one staged CSV. Returns its store summary,
+    # or {"error", "error_type"}; the staged Parquet is removed on failure.
+    try:
+        with UploadWriter(parquet_path) as writer:
+            agg = stream_aggregate(csv_path, sink=lambda df, _: writer.write(df), user_folder=folder)
+        return summarize_upload(agg)
+    except Exception as e:
+        return {"error": str(e), "error_type": type(e).__name__}
+
+# ------------------------------
+# Batch
+# ------------------------------
+def _combined_summary(entries, folder):
+    from analytics import SalesHistory
+
+    ranges = [e["date_range"] for e in entries if e.get("date_range")]
+    history = SalesHistory(entries, folder)
+    return {
+        "files": len(entries),
+        "rows": sum(e["rows"] for e in entries),
+        "date_range": [min(r[0] for r in ranges), max(r[1] for r in ranges)] if ranges else None,
+        **history.summary(max(1, history.span())),
+    }
+
+def pool_context():
+    # Start method for every process pool of the app (batch uploads,
+    # segments, the ASGI front). The API and dashboard run threads; forked
+    # children only inherit a clean single-threaded server process this way
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+
+def _free_name(folder, timestamp, index):
+    while True:
+        filename = new_upload_name(f"{timestamp}_{index:03d}")
+        if not os.path.exists(os.path.join(folder, filename)):
+            return filename
+        index += 1
+
+def process_batch(files, folder, workers=BATCH_WORKERS):
+    # Stages every file, analyses them in parallel, then commits all good
+    # uploads to the user folder and the aggregate store in one step (one
+    # rename per file, one store write). Files that fail are reported and
+    # leave nothing behind.
+    os.makedirs(folder, exist_ok=True)
+    staging_dir = state_path(folder, f"batch-{uuid.uuid4().hex}")
+    os.makedirs(staging_dir)
+    try:
+        staged = stage_files(files, staging_dir)
+        parquet_paths = [path[:-len(".csv")] + UPLOAD_FORMAT for _, path in staged]
+        csv_paths = [path for _, path in staged]
+
+        workers = max(1, min(workers, len(staged)))
+        if workers == 1:
+            summaries = list(map(process_file, csv_paths, parquet_paths, [folder] * len(staged)))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+                summaries = list(pool.map(process_file, csv_paths, parquet_paths, [folder] * len(staged)))
+
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        store = UploadStore(folder)
+        results, entries = [], []
+        for i, ((name, _), parquet_path, summary) in enumerate(zip(staged, parquet_paths, summaries)):
+            if "error" in summary:
+                results.append({"source": name, **summary})
+                continue
+            filename = _free_name(folder, timestamp, i)
+            os.replace(parquet_path, os.path.join(folder, filename))
+            entry = store.add_summary(filename, summary, save=False)
+            entries.append(entry)
+            results.append({"source": name, "file": filename, "rows": entry["rows"],
+                            "date_range": entry["date_range"], "insights": entry["insights"],
+                            "advice": entry["advice"]})
+        if entries:
+            store.save()
+        return {
+            "files": results,
+            "saved": len(entries),
+            "failed": len(results) - len(entries),
+            "combined": _combined_summary(entries, folder) if entries else None,
+        }
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
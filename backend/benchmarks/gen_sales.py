@@ -0,0 +1,64 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# ------------------------------
+# Synthetic sales CSVs
+# ------------------------------
+# Same columns as the real uploads in data/<phone>/*.csv
+COLUMNS = ['product', 'quantity_sold', 'stock_left', 'customer_id', 'date',
+           'price_per_unit', 'store_location', 'salesperson', 'promotion_applied']
+STORES = ['Delhi', 'Mumbai', 'Bangalore', 'Pune', 'Jaipur']
+SALESPEOPLE = ['Rita', 'Meena', 'Aman', 'Ravi', 'Kiran']
+PRICES = [99, 249, 499, 899, 1299, 1799]
+START = pd.Timestamp('2024-01-01')
+CHUNK_ROWS = 500_000
+
+def generate_sales(rows, skus=50, customers=500, months=6, seed=0):
+    # Product popularity is skewed (Zipf-like), like real shop data, so the
+    # top-N and low-stock paths see realistic key distributions.
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, skus + 1)
+    product = rng.choice(skus, rows, p=weights / weights.sum())
+    days = (START + pd.DateOffset(months=months) - START).days
+    sku_names = np.array([f"SKU{i:05d}" for i in range(skus)], dtype=object)
+    customer_ids = np.array([f"C{i:06d}" for i in range(customers)], dtype=object)
+    dates = np.asarray(pd.date_range(START, periods=days, freq='D').strftime('%Y-%m-%d'), dtype=object)
+    return pd.DataFrame({
+        'product': sku_names[product],
+        'quantity_sold': rng.integers(1, 30, rows),
+        'stock_left': rng.integers(0, 50, rows),
+        'customer_id': customer_ids[rng.integers(0, customers, rows)],
+        'date': dates[rng.integers(0, days, rows)],
+        'price_per_unit': rng.choice(PRICES, rows),
+        'store_location': rng.choice(STORES, rows),
+        'salesperson': rng.choice(SALESPEOPLE, rows),
+        'promotion_applied': rng.choice(['Yes', 'No'], rows, p=[0.3, 0.7]),
+    }, columns=COLUMNS)
+
+def write_sales_csv(path, rows, skus=50, customers=500, months=6, seed=0, chunk_rows=CHUNK_ROWS):
+    # Written in chunks so 10M-row files never sit in memory whole
+    written = 0
+    with open(path, 'w', newline='') as f:
+        while written < rows:
+            n = min(chunk_rows, rows - written)
+            df = generate_sales(n, skus, customers, months, seed + written)
+            df.to_csv(f, index=False, header=written == 0)
+            written += n
+    return path
+
+# ------------------------------
+# CLI: python -m benchmarks.gen_sales out.csv --rows 1000000
+# ------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic sales CSV.")
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--skus", type=int, default=50)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_sales_csv(args.path, args.rows, args.skus, args.customers, args.months, args.seed)
+    print(f"Wrote {args.rows} rows to {args.path}")
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import statistics
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.gen_sales import write_sales_csv
+
+# ------------------------------
+# Config
+# ------------------------------
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_VERSION = 1
+REPEAT = 3
+TOLERANCE = 0.25      # slower / bigger than baseline by more than this = regression
+
+# ------------------------------
+# Measurement
+# ------------------------------
+def _rss_bytes():
+    # Resident set size from /proc (Linux); None where unavailable
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+class RssSampler:
+    # Peak RSS growth while running: catches Arrow-backed strings and other
+    # native buffers that tracemalloc does not see
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.start_rss = self.peak_rss = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, _rss_bytes() or 0)
+
+    def __enter__(self):
+        if self.start_rss is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start_rss is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_rss = max(self.peak_rss, _rss_bytes() or 0)
+        return False
+
+    @property
+    def growth_mb(self):
+        return round((self.peak_rss - self.start_rss) / 2**20, 2) if self.start_rss is not None else None
+
+def measure(fn, setup=None, repeat=REPEAT):
+    # Timed runs without tracing, then one traced run for peak Python/NumPy
+    # heap use and RSS growth. setup() builds fresh inputs outside the timed
+    # region.
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        with RssSampler() as rss:
+            fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "best_secs": round(min(times), 4),
+        "median_secs": round(statistics.median(times), 4),
+        "peak_mb": round(peak / 2**20, 2),
+        "peak_rss_growth_mb": rss.growth_mb,
+    }
+
+# ------------------------------
+# Stages
+# ------------------------------
+def _fresh_user(workdir, csv_path, cleaned):
+    # A user folder holding the benchmark file as one cleaned upload, with no
+    # derived state, so the forecast stage always starts cold
+    from upload_store import write_upload
+
+    folder = os.path.join(workdir, "user")
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    write_upload(cleaned.copy(), os.path.join(folder, "2024-01-01_00-00-00.parquet"))
+    return (folder,)
+
+def _fresh_chart_cache(workdir, agg):
+    import charts
+
+    charts.CHART_CACHE_DIR = os.path.join(workdir, "charts")
+    shutil.rmtree(charts.CHART_CACHE_DIR, ignore_errors=True)
+    return (agg,)
+
+def run_stages(csv_path, rows, workdir, repeat=REPEAT, only=None):
+    from data_cleaner import clean_dataframe
+    from biz_insights import generate_insights, extract_monthly_sales, forecast_top_products
+    from sales_frame import SalesFrame
+    from streaming import stream_aggregate
+    from charts import render_charts
+
+    raw = pd.read_csv(csv_path)
+    cleaned = clean_dataframe(raw.copy())
+    agg = SalesFrame(cleaned, {c: c for c in cleaned.columns}).aggregates
+
+    stages = {
+        "read_csv": (lambda: pd.read_csv(csv_path), None),
+        "clean_dataframe": (clean_dataframe, lambda: (raw.copy(),)),
+        "generate_insights": (generate_insights, lambda: (raw.copy(),)),
+        "extract_monthly_sales": (extract_monthly_sales, lambda: (raw.copy(),)),
+        "stream_aggregate": (lambda: stream_aggregate(csv_path), None),
+        "forecast_top_products": (forecast_top_products, lambda: _fresh_user(workdir, csv_path, cleaned)),
+        "render_charts": (render_charts, lambda: _fresh_chart_cache(workdir, agg)),
+    }
+    results = {}
+    for name, (fn, setup) in stages.items():
+        if only and name not in only:
+            continue
+        result = measure(fn, setup, repeat)
+        result["rows_per_sec"] = round(rows / result["best_secs"]) if result["best_secs"] else None
+        results[name] = result
+        print(f"  {name:<24} {result['best_secs']:>9.4f}s  {result['rows_per_sec'] or 0:>12,} rows/s"
+              f"  heap {result['peak_mb']:>8.1f} MB  rss +{result['peak_rss_growth_mb'] or 0:.1f} MB", flush=True)
+    return results
+
+def run(sizes, skus, customers, months, repeat=REPEAT, only=None, seed=0):
+    runs = []
+    workdir = tempfile.mkdtemp(prefix="vyapaar-bench-")
+    try:
+        for rows in sizes:
+            csv_path = write_sales_csv(os.path.join(workdir, f"sales_{rows}.csv"), rows,
+                                       skus, customers, months, seed)
+            print(f"{rows:,} rows, {skus} SKUs, {customers} customers, {months} months")
+            runs.append({"rows": rows, "stages": run_stages(csv_path, rows, workdir, repeat, only)})
+            os.remove(csv_path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "version": RESULTS_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {"skus": skus, "customers": customers, "months": months, "repeat": repeat, "seed": seed},
+        "env": {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+                "machine": platform.machine(), "cpus": os.cpu_count()},
+        "runs": runs,
+    }
+
+# ------------------------------
+# Baseline comparison
+# ------------------------------
+# Parameters that change the generated data; runs differing in any of them
+# are not comparable
+DATA_PARAMS = ("skus", "customers", "months", "seed")
+
+def param_mismatch(results, baseline):
+    # "name: baseline -> current" for each data parameter that differs
+    base, current = baseline.get("params", {}), results["params"]
+    return [f"{name}: {base.get(name)} -> {current.get(name)}"
+            for name in DATA_PARAMS if base.get(name) != current.get(name)]
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # (regressions as readable lines, number of stage runs compared); only
+    # runs and stages present in both count
+    regressions, compared = [], 0
+    base_runs = {r["rows"]: r["stages"] for r in baseline.get("runs", [])}
+    for run_ in results["runs"]:
+        base_stages = base_runs.get(run_["rows"], {})
+        for name, stats in run_["stages"].items():
+            base = base_stages.get(name)
+            if not base:
+                continue
+            compared += 1
+            for metric in ("median_secs", "peak_mb"):
+                if base[metric] and stats[metric] > base[metric] * (1 + tolerance):
+                    regressions.append(f"{run_['rows']:,} rows / {name}: {metric} "
+                                       f"{base[metric]} -> {stats[metric]}")
+    return regressions, compared
+
+def save(results, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+# ------------------------------
+# CLI: python -m benchmarks.run --rows 100000 1000000
+# ------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, insights, forecasting and charts.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000])
+    parser.add_argument("--skus", type=int, default=50)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--stage", action="append", help="only run this stage (repeatable)")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="compare against this results file")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    results = run(args.rows, args.skus, args.customers, args.months, args.repeat, args.stage)
+    save(results, os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json"))
+
+    if args.save_baseline:
+        save(results, args.baseline)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatch = param_mismatch(results, baseline)
+        if mismatch:
+            sys.exit(f"Not compared: baseline used different parameters ({', '.join(mismatch)})")
+        regressions, compared = compare(results, baseline, args.tolerance)
+        if not compared:
+            rows = sorted(r["rows"] for r in baseline.get("runs", []))
+            sys.exit(f"Nothing compared: the baseline has no matching row sizes or stages (baseline rows: {rows})")
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against baseline ({compared} stage run(s) compared)")
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from upload_store import DATA_DIR, UploadStore
+from user_registry import REGISTRY_DB, UserRegistry
+
+# ------------------------------
+# Config
+# ------------------------------
+TWILIO_API_URL = os.getenv("WHATSAPP_API_URL", "http://localhost:5000/send-whatsapp")
+PROCESSES = os.cpu_count() or 2
+CONCURRENCY = 16
+REQUEST_TIMEOUT = 15
+
+# ------------------------------
+# Step 1: latest summary per user (process pool)
+# ------------------------------
+def load_users(path=REGISTRY_DB):
+    return UserRegistry(path).all()
+
+def summarize_user(phone, name, data_dir=DATA_DIR):
+    # Runs in a worker process. Uses the per-user aggregate store, so only
+    # uploads that were never analysed are parsed.
+    folder = os.path.join(data_dir, phone)
+    try:
+        entries = [e for e in UploadStore(folder).sync() if "error" not in e]
+        if not entries:
+            return {"phone": phone, "skipped": "no uploads"}
+        latest = entries[-1]
+        message = f"Hi {name}, summary for {latest['file']}:\n{latest['advice']}"
+        return {"phone": phone, "message": message}
+    except Exception as e:
+        return {"phone": phone, "error": str(e)}
+
+def build_summaries(users, data_dir=DATA_DIR, processes=PROCESSES):
+    phones = [p for p in users if os.path.isdir(os.path.join(data_dir, p))]
+    names = [users[p].get("name", "") for p in phones]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(summarize_user, phones, names, [data_dir] * len(phones), chunksize=8))
+
+# ------------------------------
+# Step 2: send through one pooled HTTP session
+# ------------------------------
+def make_session(concurrency=CONCURRENCY):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def send_all(summaries, api_url=TWILIO_API_URL, concurrency=CONCURRENCY, session=None):
+    session = session or make_session(concurrency)
+
+    def send(summary):
+        start = time.perf_counter()
+        try:
+            res = session.post(api_url, json={"phone": summary["phone"], "message": summary["message"]},
+                               timeout=REQUEST_TIMEOUT)
+            ok = res.status_code in (200, 202)
+            error = None if ok else f"HTTP {res.status_code}"
+        except Exception as e:
+            ok, error = False, str(e)
+        return {"phone": summary["phone"], "ok": ok, "error": error,
+                "latency": time.perf_counter() - start}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(send, summaries))
+
+# ------------------------------
+# Reporting
+# ------------------------------
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def build_report(summaries, results, compute_secs, send_secs):
+    latencies = [r["latency"] for r in results]
+    sent = sum(r["ok"] for r in results)
+    return {
+        "users": len(summaries),
+        "skipped": sum("skipped" in s for s in summaries),
+        "summary_errors": {s["phone"]: s["error"] for s in summaries if "error" in s},
+        "sent": sent,
+        "send_failures": {r["phone"]: r["error"] for r in results if not r["ok"]},
+        "compute_secs": round(compute_secs, 3),
+        "send_secs": round(send_secs, 3),
+        "throughput_msgs_per_sec": round(sent / send_secs, 2) if send_secs else 0.0,
+        "latency_ms": {f"p{q}": round(percentile(latencies, q) * 1000, 1) for q in (50, 95, 99)},
+    }
+
+def run(users_path=REGISTRY_DB, data_dir=DATA_DIR, api_url=TWILIO_API_URL,
+        processes=PROCESSES, concurrency=CONCURRENCY, dry_run=False):
+    start = time.perf_counter()
+    summaries = build_summaries(load_users(users_path), data_dir, processes)
+    compute_secs = time.perf_counter() - start
+
+    ready = [s for s in summaries if "message" in s]
+    start = time.perf_counter()
+    results = [] if dry_run else send_all(ready, api_url, concurrency)
+    send_secs = time.perf_counter() - start
+    return build_report(summaries, results, compute_secs, send_secs)
+
+# ------------------------------
+# CLI
+# ------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send each registered shop its latest WhatsApp summary.")
+    parser.add_argument("--registry", default=REGISTRY_DB)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--api-url", default=TWILIO_API_URL)
+    parser.add_argument("--processes", type=int, default=PROCESSES)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--dry-run", action="store_true", help="compute summaries but do not send")
+    args = parser.parse_args()
+
+    report = run(args.registry, args.data_dir, args.api_url, args.processes, args.concurrency, args.dry_run)
+    print(json.dumps(report, indent=2))
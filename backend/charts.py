@@ -0,0 +1,141 @@
+import os
+import json
+import base64
+import hashlib
+from io import BytesIO
+
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from upload_store import DATA_DIR, state_path
+from metrics import stage
+
+# ------------------------------
+# Config
+# ------------------------------
+# Rendered PNGs are content-addressed by what they plot, so the same
+# aggregates never get drawn twice, whichever user or upload they come from.
+CHART_VERSION = 1
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR")    # default: data/.vyapaar/charts
+GRID_COLOR = "0.8"
+
+def _cache_dir():
+    return CHART_CACHE_DIR or state_path(DATA_DIR, "charts")
+
+def chart_key(kind, data):
+    payload = json.dumps({"kind": kind, "v": CHART_VERSION, "data": data}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _cache_path(key):
+    folder = os.path.join(_cache_dir(), key[:2])
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{key}.png")
+
+def _cached_png(kind, data, draw):
+    # Returns (key, png bytes); draws and stores the chart on a miss
+    key = chart_key(kind, data)
+    path = _cache_path(key)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return key, f.read()
+    png = draw(data)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(png)
+    os.replace(tmp, path)
+    return key, png
+
+def to_data_uri(png):
+    return f"data:image/png;base64,{base64.b64encode(png).decode()}"
+
+# ------------------------------
+# Figure pipeline (no pyplot state)
+# ------------------------------
+def _new_figure(figsize):
+    # Each chart owns its Figure + Agg canvas, so renders are independent
+    # and safe to run from several threads.
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+def _whitegrid(ax):
+    ax.set_axisbelow(True)
+    ax.grid(True, color=GRID_COLOR, linewidth=0.8)
+    for spine in ax.spines.values():
+        spine.set_color(GRID_COLOR)
+
+def _png(fig):
+    buf = BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    return buf.getvalue()
+
+def _draw_sales_trend(trend):
+    fig, ax = _new_figure((8, 4))
+    _whitegrid(ax)
+    ax.plot(list(trend.keys()), list(trend.values()), marker="o")
+    ax.set_title("Monthly Sales Trend")
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Quantity Sold")
+    ax.tick_params(axis="x", labelrotation=45)
+    fig.tight_layout()
+    return _png(fig)
+
+def _draw_top_products(top):
+    fig, ax = _new_figure((6, 6))
+    ax.pie(list(top.values()), labels=list(top.keys()), autopct="%1.1f%%", startangle=90)
+    ax.set_title("Top 5 Products by Quantity Sold")
+    return _png(fig)
+
+def _draw_top_customers(top):
+    fig, ax = _new_figure((6, 4))
+    _whitegrid(ax)
+    colors = colormaps["magma"](np.linspace(0, 1, len(top) + 2)[1:-1])
+    ax.bar(list(top.keys()), list(top.values()), color=colors)
+    ax.set_title("Top 5 Customers by Purchase Frequency")
+    ax.set_xlabel("Customer ID")
+    ax.set_ylabel("Number of Purchases")
+    return _png(fig)
+
+# ------------------------------
+# Chart data from aggregates
+# ------------------------------
+def _plain(series):
+    return {str(k): v.item() if hasattr(v, "item") else v for k, v in series.items()}
+
+def sales_trend_data(agg):
+    if agg.monthly_quantity is None or agg.monthly_quantity.empty:
+        return None
+    return _plain(agg.monthly_quantity)
+
+def top_products_data(agg):
+    if agg.product_quantity is None or agg.product_quantity.empty:
+        return None
+    return _plain(agg.product_quantity.sort_values(ascending=False).head(5))
+
+def top_customers_data(agg):
+    if agg.customer_counts is None or agg.customer_counts.empty:
+        return None
+    return _plain(agg.customer_counts.head(5))
+
+CHARTS = {
+    "sales_trend": (sales_trend_data, _draw_sales_trend),
+    "top_products": (top_products_data, _draw_top_products),
+    "top_customers": (top_customers_data, _draw_top_customers),
+}
+
+# ------------------------------
+# Public API
+# ------------------------------
+def render_chart(kind, agg):
+    # PNG bytes for one chart, or None when the data it needs is missing
+    data_fn, draw = CHARTS[kind]
+    data = data_fn(agg)
+    if data is None:
+        return None
+    with stage("chart"):
+        return _cached_png(kind, data, draw)[1]
+
+def render_charts(agg):
+    return {kind: render_chart(kind, agg) for kind in CHARTS}
@@ -0,0 +1,149 @@
+import os
+import json
+
+import numpy as np
+from scipy import sparse
+
+from symbols import CodedHistory, SymbolTable
+from upload_store import UploadStore, state_path
+
+# ------------------------------
+# Config
+# ------------------------------
+# data/<phone>/.vyapaar/copurchase.npz   one file, replaced atomically:
+#   baskets_*   customers x products, quantity bought (CSR parts)
+#   cooccur_*   products x products, customers who bought both (CSR parts)
+#   uploads     JSON {file: sha256} of the uploads folded in
+INDEX_FILE = "copurchase.npz"
+INDEX_VERSION = 2
+MIN_SHARED_CUSTOMERS = 2
+ALSO_BOUGHT_N = 3
+
+def _fit(matrix, shape):
+    # Grow a CSR matrix to `shape` (codes only ever get added)
+    if matrix.shape != shape:
+        matrix = matrix.tocsr(copy=True)
+        matrix.resize(shape)
+    return matrix
+
+def _baskets(coded, shape):
+    return sparse.csr_matrix(
+        (coded["basket_quantity"], (coded["basket_customers"], coded["basket_products"])), shape=shape)
+
+# ------------------------------
+# Co-purchase index
+# ------------------------------
+class CoPurchaseIndex:
+    # Sparse customer x product basket matrix over all of a shop's uploads,
+    # plus the product co-occurrence matrix C = B.T @ B of its binary form
+    # (C[x, y]: customers who bought both x and y; C[x, x]: buyers of x).
+    # Rows and columns are the shop's symbol-table codes, so nothing is ever
+    # densified. New uploads update C only through the customers they touch:
+    #   C += B_new[rows].T @ B_new[rows] - B_old[rows].T @ B_old[rows]
+    # A removed or changed upload triggers a full rebuild.
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = state_path(folder, INDEX_FILE)
+        self.uploads = {}
+        self.baskets = sparse.csr_matrix((0, 0), dtype='int64')
+        self.cooccur = sparse.csr_matrix((0, 0), dtype='int64')
+        self.table = SymbolTable(folder)
+        self._load()
+
+    def _load(self):
+        try:
+            with np.load(self.path) as data:
+                if int(data["version"]) != INDEX_VERSION:
+                    return
+                uploads = json.loads(str(data["uploads"]))
+                baskets, cooccur = (sparse.csr_matrix(
+                    (data[f"{name}_data"], data[f"{name}_indices"], data[f"{name}_indptr"]),
+                    shape=tuple(data[f"{name}_shape"])) for name in ("baskets", "cooccur"))
+        except (OSError, ValueError, KeyError):
+            return
+        self.uploads, self.baskets, self.cooccur = uploads, baskets, cooccur
+
+    def save(self):
+        # Matrices and the upload list go in one file, so a reader never
+        # pairs new matrices with an old upload list
+        parts = {}
+        for name, m in (("baskets", self.baskets), ("cooccur", self.cooccur)):
+            parts.update({f"{name}_data": m.data, f"{name}_indices": m.indices,
+                          f"{name}_indptr": m.indptr, f"{name}_shape": np.asarray(m.shape)})
+        tmp = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, version=INDEX_VERSION, uploads=json.dumps(self.uploads), **parts)
+        os.replace(tmp, self.path)
+
+    @classmethod
+    def for_user(cls, folder, entries=None):
+        index = cls(folder)
+        index.update(entries if entries is not None else UploadStore(folder).sync())
+        return index
+
+    def update(self, entries):
+        # Folds in uploads not indexed yet; returns how many were added.
+        # Coded uploads are only loaded when the set of uploads changed.
+        current = {e["file"]: e["sha256"] for e in entries if "error" not in e}
+        if current == self.uploads:
+            return 0
+        history = CodedHistory(self.folder, entries)
+        self.table = history.table
+        if any(current.get(f) != sha for f, sha in self.uploads.items()):
+            self.uploads = {}
+            self.baskets = sparse.csr_matrix((0, 0), dtype='int64')
+            self.cooccur = sparse.csr_matrix((0, 0), dtype='int64')
+
+        shape = (history.table.size("customer_id"), history.table.size("product"))
+        new = [c for (f, sha), c in zip(history.uploads, history.coded) if f not in self.uploads]
+        old = _fit(self.baskets, shape)
+        self.cooccur = _fit(self.cooccur, (shape[1], shape[1]))
+        if new:
+            delta = sum((_baskets(c, shape) for c in new), sparse.csr_matrix(shape, dtype='int64'))
+            rows = np.unique(delta.nonzero()[0])
+            self.baskets = (old + delta).tocsr()
+            before = (old[rows] > 0).astype('int64')
+            after = (self.baskets[rows] > 0).astype('int64')
+            self.cooccur = (self.cooccur + after.T @ after - before.T @ before).tocsr()
+            self.cooccur.eliminate_zeros()
+        else:
+            self.baskets = old
+        self.uploads = dict(history.uploads)
+        self.save()
+        return len(new)
+
+    # ------------------------------
+    # Queries
+    # ------------------------------
+    def _code(self, product):
+        return self.table.code("product", product)
+
+    def top_products(self, n):
+        # Most bought products by quantity, from the basket matrix
+        quantity = np.asarray(self.baskets.sum(axis=0)).ravel()
+        order = np.lexsort((np.arange(len(quantity)), -quantity))[:n]
+        return self.table.decode("product", order[quantity[order] > 0])
+
+    def also_bought(self, product, n=ALSO_BOUGHT_N):
+        # "Customers who bought X also bought Y": products sharing the most
+        # customers with X. confidence: share of X's buyers who bought Y;
+        # lift: how much likelier that is than for an average customer.
+        code = self._code(product)
+        if code is None or code >= self.cooccur.shape[0]:
+            return []
+        row = self.cooccur.getrow(code)
+        buyers = int(row[0, code])
+        customers = max(int(np.count_nonzero(np.diff(self.baskets.indptr))), 1)
+        support = self.cooccur.diagonal().tolist()
+        picks = [(int(shared), int(y)) for y, shared in zip(row.indices, row.data)
+                 if y != code and shared >= MIN_SHARED_CUSTOMERS]
+        picks.sort(key=lambda p: (-p[0], p[1]))
+        names = self.table.decode("product", [y for _, y in picks[:n]])
+        return [{
+            "product": name,
+            "customers": shared,
+            "confidence": round(shared / buyers, 3) if buyers else None,
+            "lift": round(shared / buyers / (support[y] / customers), 2) if buyers and support[y] else None,
+        } for name, (shared, y) in zip(names, picks[:n])]
+
+    def recommendations(self, products, n=ALSO_BOUGHT_N):
+        return [{"product": p, "also_bought": self.also_bought(p, n)} for p in products]
@@ -1,49 +1,264 @@
 import pandas as pd
+import numpy as np
 import re
+import os
+import json
+import hashlib
+
+from metrics import inc, stage
+
+# Bump whenever cleaning or mapping rules change, so cached results are invalidated
+CLEANER_VERSION = 3
 
 def clean_column_names(cols):
     return [re.sub(r'[^a-z0-9]', '_', col.strip().lower()) for col in cols]
 
+# ------------------------------
+# Schema definition
+# ------------------------------
+# For every standard field: exact header names (the first is the standard name
+# itself), header tokens that point to it, and tokens that rule it out.
+FIELDS = {
+    'product': {
+        'names': ['product', 'product_name', 'item', 'item_name', 'sku', 'product_id', 'item_id'],
+        'tokens': ['product', 'item', 'sku', 'article'],
+    },
+    'quantity_sold': {
+        'names': ['quantity_sold', 'quantity', 'qty', 'qty_sold', 'units_sold', 'units'],
+        'tokens': ['quantity', 'qty', 'sold', 'units'],
+    },
+    'stock_left': {
+        'names': ['stock_left', 'stock', 'stock_remaining', 'remaining_stock', 'inventory', 'closing_stock'],
+        'tokens': ['stock', 'inventory', 'remaining', 'left'],
+    },
+    'customer_id': {
+        'names': ['customer_id', 'customer', 'customer_name', 'client_id', 'buyer_id', 'buyer'],
+        'tokens': ['customer', 'buyer', 'client'],
+    },
+    'date': {
+        'names': ['date', 'order_date', 'sale_date', 'invoice_date', 'transaction_date', 'created_at'],
+        'tokens': ['date', 'created'],
+    },
+    'unit_price': {
+        'names': ['unit_price', 'price_per_unit', 'price', 'selling_price', 'mrp', 'rate'],
+        'tokens': ['price', 'mrp', 'rate'],
+        'exclude': ['total', 'amount', 'revenue'],
+    },
+    'store_location': {
+        'names': ['store_location', 'store', 'location', 'branch', 'outlet', 'store_name'],
+        'tokens': ['store', 'branch', 'outlet', 'location', 'city'],
+    },
+    'salesperson': {
+        'names': ['salesperson', 'sales_person', 'salesman', 'seller', 'cashier', 'staff'],
+        'tokens': ['salesperson', 'salesman', 'seller', 'cashier', 'staff', 'employee'],
+    },
+    'promotion_applied': {
+        'names': ['promotion_applied', 'promotion', 'promo', 'promo_applied', 'offer_applied'],
+        'tokens': ['promotion', 'promo', 'offer'],
+    },
+}
+REQUIRED_FIELDS = ['product', 'quantity_sold', 'stock_left', 'customer_id']
+INT_FIELDS = ['quantity_sold', 'stock_left']
+CATEGORY_FIELDS = ['product', 'customer_id', 'store_location', 'salesperson', 'promotion_applied']
+
+SCORE_CANONICAL = 100
+SCORE_NAME = 90
+SCORE_TOKEN = 60
+SCORE_SUBSTRING = 30
+
+# Compiled once: field -> (canonical, names, token set, exclude set, substring regex)
+_COMPILED = {
+    field: (
+        spec['names'][0],
+        frozenset(spec['names']),
+        frozenset(spec['tokens']),
+        frozenset(spec.get('exclude', ())),
+        re.compile('|'.join(map(re.escape, spec['tokens']))),
+    )
+    for field, spec in FIELDS.items()
+}
+_FIELD_ORDER = {field: i for i, field in enumerate(FIELDS)}
+
+def score_column(name, field):
+    canonical, names, tokens, exclude, pattern = _COMPILED[field]
+    parts = set(filter(None, name.split('_')))
+    if parts & exclude:
+        return 0
+    if name == canonical:
+        return SCORE_CANONICAL
+    if name in names:
+        return SCORE_NAME
+    if parts & tokens:
+        return SCORE_TOKEN
+    if pattern.search(name):
+        return SCORE_SUBSTRING
+    return 0
+
+# ------------------------------
+# Schema inference
+# ------------------------------
+def infer_schema(columns):
+    # One-to-one, deterministic mapping {field: column}. Higher scores win;
+    # ties go to the field listed first in FIELDS, then the leftmost column.
+    candidates = []
+    for idx, col in enumerate(columns):
+        for field in FIELDS:
+            score = score_column(col, field)
+            if score:
+                candidates.append((-score, _FIELD_ORDER[field], idx, field, col))
+    candidates.sort()
+
+    col_map, used = {}, set()
+    for _, _, _, field, col in candidates:
+        if field not in col_map and col not in used:
+            col_map[field] = col
+            used.add(col)
+    return {field: col_map[field] for field in FIELDS if field in col_map}
+
 def map_columns(df):
-    col_map = {}
+    return infer_schema(list(df.columns))
 
-    for col in df.columns:
-        name = col.lower()
+def header_signature(columns):
+    return hashlib.sha1("\x1f".join(columns).encode()).hexdigest()
+
+# ------------------------------
+# Schema cache (per process and per user)
+# ------------------------------
+_SCHEMA_MEMO = {}
+_SCHEMA_MEMO_MAX = 1024
+SCHEMA_FILE = "schemas.json"
+
+class SchemaCache:
+    # Remembers {header signature: {"col_map", "date_format"}} for one shop in
+    # data/<phone>/.vyapaar/schemas.json, so repeat uploads skip inference.
+    def __init__(self, user_folder):
+        from upload_store import state_path
+
+        self.path = state_path(user_folder, SCHEMA_FILE)
+        self.schemas = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                if data.get("cleaner") == CLEANER_VERSION:
+                    self.schemas = data.get("schemas", {})
+            except (OSError, ValueError):
+                self.schemas = {}
+
+    def get(self, signature):
+        return self.schemas.get(signature)
+
+    def put(self, signature, schema):
+        from upload_store import write_json_atomic
 
-        if any(key in name for key in ['product', 'item', 'sku']):
-            col_map['product'] = col
-        elif any(key in name for key in ['quantity', 'qty', 'sold', 'units']):
-            col_map['quantity_sold'] = col
-        elif any(key in name for key in ['stock', 'left', 'remaining']):
-            col_map['stock_left'] = col
-        elif any(key in name for key in ['customer', 'buyer', 'client', 'id']):
-            col_map['customer_id'] = col
-        elif any(key in name for key in ['date', 'order date', 'created']):
-            col_map['date'] = col
+        self.schemas[signature] = schema
+        write_json_atomic(self.path, {"cleaner": CLEANER_VERSION, "schemas": self.schemas})
 
-    return col_map
+def _guess_date_format(values):
+    sample = values.dropna()
+    if sample.empty:
+        return None
+    return pd.tseries.api.guess_datetime_format(str(sample.iloc[0]))
+
+def _date_format_of(df, col_map):
+    if 'date' in col_map and not pd.api.types.is_datetime64_any_dtype(df[col_map['date']]):
+        return _guess_date_format(df[col_map['date']])
+    return None
+
+def resolve_schema(df, user_folder=None):
+    # Cleaned headers -> {"col_map", "date_format"}, from the process memo,
+    # then the user's schemas.json, and only then by inference. Keyed per user
+    # as well, since two shops can share headers but not date formats. Without
+    # a user only the column mapping is memoised; the date format is guessed
+    # from each file, so one shop's day-first dates never decide another's.
+    signature = header_signature(df.columns)
+    key = (user_folder, signature)
+    schema = _SCHEMA_MEMO.get(key)
+    if schema is None:
+        schema_cache = SchemaCache(user_folder) if user_folder else None
+        if schema_cache is not None:
+            schema = schema_cache.get(signature)
+        if schema is None:
+            col_map = infer_schema(list(df.columns))
+            schema = {"col_map": col_map,
+                      "date_format": _date_format_of(df, col_map) if user_folder else None}
+            if schema_cache is not None:
+                schema_cache.put(signature, schema)
+        if len(_SCHEMA_MEMO) >= _SCHEMA_MEMO_MAX:
+            _SCHEMA_MEMO.clear()
+        _SCHEMA_MEMO[key] = schema
+
+    if user_folder is None:
+        return {"col_map": schema["col_map"], "date_format": _date_format_of(df, schema["col_map"])}
+    return schema
+
+# ------------------------------
+# Compact dtype conversion
+# ------------------------------
+def _to_int(s):
+    values = pd.to_numeric(s, errors='coerce').fillna(0)
+    if values.dtype.kind == 'f':
+        values = np.trunc(values)
+    lo, hi = (values.min(), values.max()) if len(values) else (0, 0)
+    info = np.iinfo(np.int32)
+    return values.astype(np.int32 if info.min <= lo and hi <= info.max else np.int64)
+
+def _to_category(s):
+    # Strip whitespace on the distinct values only, not on every row. Missing
+    # values stay missing (code -1), as astype(str) left them NaN before, so
+    # counts and rankings skip them.
+    cat = s if isinstance(s.dtype, pd.CategoricalDtype) else s.astype('category')
+    categories = cat.cat.categories.astype(str).str.strip()
+    codes = cat.cat.codes.to_numpy()
+    if not categories.is_unique:
+        categories, inverse = np.unique(np.asarray(categories, dtype=object), return_inverse=True)
+        codes = np.where(codes >= 0, inverse[np.maximum(codes, 0)], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=s.index, name=s.name)
+
+def _to_datetime(s, date_format):
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    if date_format:
+        parsed = pd.to_datetime(s, format=date_format, errors='coerce')
+        # Fall back to per-value parsing if the cached format no longer fits
+        if parsed.notna().sum() >= s.notna().sum():
+            return parsed
+    return pd.to_datetime(s, errors='coerce')
 
 # Clean & Standardize DataFrame
 def clean_dataframe(df):
+    df, _ = clean_and_map(df)
+    return df
+
+# Same as clean_dataframe, but also returns the column mapping it applied.
+# Pass the user's folder to reuse (and remember) the shop's header schema.
+@stage("clean")
+def clean_and_map(df, user_folder=None, schema=None):
+    # `schema` (from resolve_schema) skips the lookup, e.g. for later chunks
+    # of a file, which must be parsed the same way as its first chunk
+    inc("rows_processed_total", len(df))
     df.columns = clean_column_names(df.columns)
-    col_map = map_columns(df)
+    schema = schema or resolve_schema(df, user_folder)
+    col_map = schema["col_map"]
 
-    required_keys = ['product', 'quantity_sold', 'stock_left', 'customer_id']
-    missing = [k for k in required_keys if k not in col_map]
+    missing = [k for k in REQUIRED_FIELDS if k not in col_map]
     if missing:
         raise ValueError(f"Missing important fields: {missing}")
 
-    # Rename columns to standard ones
-    df = df.rename(columns={v: k for k, v in col_map.items()})
-
-    # Fill missing values
-    df['quantity_sold'] = pd.to_numeric(df['quantity_sold'], errors='coerce').fillna(0).astype(int)
-    df['stock_left'] = pd.to_numeric(df['stock_left'], errors='coerce').fillna(0).astype(int)
-    df['product'] = df['product'].astype(str).str.strip()
-    df['customer_id'] = df['customer_id'].astype(str).str.strip()
-
-    # Handle dates (optional)
-    if 'date' in col_map:
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-
-    return df
+    # One pass: every converted column is built once, renamed to its standard
+    # name, and the frame is assembled in a single step.
+    renamed = {v: k for k, v in col_map.items()}
+    columns = {}
+    for col in df.columns:
+        name = renamed.get(col, col)
+        s = df[col]
+        if name in INT_FIELDS:
+            s = _to_int(s)
+        elif name in CATEGORY_FIELDS:
+            s = _to_category(s)
+        elif name == 'date':
+            s = _to_datetime(s, schema["date_format"])
+        elif name == 'unit_price':
+            s = pd.to_numeric(s, errors='coerce')
+        columns[name] = s.rename(name)
+    return pd.DataFrame(columns, index=df.index), col_map
@@ -0,0 +1,177 @@
+import os
+import json
+
+from upload_store import load_partials, state_path, write_json_atomic
+import numpy as np
+
+from batch_forecast import series_matrix, fit_holt, fit_ses
+
+# ------------------------------
+# Config
+# ------------------------------
+FORECAST_FILE = "forecast.json"
+FORECAST_VERSION = 4
+MIN_MONTHS = 3        # calendar months, first sale to last, as in the original forecaster
+HOLT_MIN_MONTHS = 8   # a trend (two more parameters) is only tried on longer series
+REFIT_EVERY = 6       # re-optimise alpha after this many cheap level updates
+FIT_KEYS = ("alpha", "beta", "level", "trend", "rmse")
+
+def month_range(first, last):
+    # Calendar months from first to last ("YYYY-MM"), inclusive
+    year, month = int(first[:4]), int(first[5:7])
+    months = [first]
+    while months[-1] < last:
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        months.append(f"{year:04d}-{month:02d}")
+    return months
+
+def upload_month_sales(entry):
+    # {month: {product: qty}} contributed by one stored upload. Files without
+    # a usable date column count as one month, taken from the upload file name.
+    monthly = entry.get("monthly_product_quantity")
+    if monthly:
+        return monthly
+    totals = (entry.get("aggregates") or {}).get("product_quantity")
+    if not totals:
+        return {}
+    return {entry["file"][:7]: totals}
+
+# ------------------------------
+# Incremental Forecaster
+# ------------------------------
+class ProductForecaster:
+    # Keeps every product's monthly series and its fitted smoothing state
+    # (alpha, beta, last level and trend) on disk. Each refit fits simple and,
+    # for long enough series, Holt smoothing and keeps the one with the lower
+    # AIC. New uploads only touch the products they contain: observations
+    # after the last fitted month are folded into the state in O(1); anything
+    # else is refitted, all such products in one batch.
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = state_path(folder, FORECAST_FILE)
+        self.files = {}
+        self.products = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                if data.get("version") == FORECAST_VERSION:
+                    self.files = data["files"]
+                    self.products = data["products"]
+            except (OSError, ValueError, KeyError):
+                self.files, self.products = {}, {}
+
+    def save(self):
+        write_json_atomic(self.path, {"version": FORECAST_VERSION, "files": self.files,
+                                      "products": self.products})
+
+    def update(self, entries):
+        # entries: UploadStore.sync() output. Returns the set of products refreshed.
+        entries = [e for e in entries if "error" not in e]
+        current = {e["file"]: e["sha256"] for e in entries}
+
+        # A removed or rewritten upload invalidates its old contribution; the
+        # stored per-file aggregates make a rebuild cheap (no CSV parsing).
+        if any(current.get(f) != sha for f, sha in self.files.items()):
+            self.files, self.products = {}, {}
+
+        old_first, old_last = self._range()
+        touched = {}
+        for entry in entries:
+            if entry["file"] in self.files:
+                continue
+            for month, sales in upload_month_sales(load_partials(self.folder, entry)).items():
+                for product, qty in sales.items():
+                    state = self.products.setdefault(product, {"series": {}})
+                    state["series"][month] = state["series"].get(month, 0) + int(qty)
+                    touched.setdefault(product, set()).add(month)
+            self.files[entry["file"]] = entry["sha256"]
+
+        refreshed = set()
+        first, last = self._range()
+        if touched or (first, last) != (old_first, old_last):
+            # Series run over the shop's calendar months, zero where a product
+            # did not sell, so gaps count as months
+            calendar = month_range(first, last) if first else []
+            if len(calendar) < MIN_MONTHS:
+                for state in self.products.values():
+                    for key in FIT_KEYS + ("updates", "fitted_through"):
+                        state.pop(key, None)
+            elif first != old_first:
+                refreshed = set(self.products)
+                self._refit(list(self.products), calendar)
+            else:
+                # New months after the last fitted one are O(1) updates for every
+                # product (zero sales included); back-filled months mean a refit
+                appended = calendar[calendar.index(old_last) + 1:]
+                refit = [p for p, state in self.products.items()
+                         if any(m <= old_last for m in touched.get(p, ()))
+                         or not self._extend(state, appended, old_last)]
+                self._refit(refit, calendar)
+                refreshed = set(refit) | (set(self.products) if appended else set())
+            self.save()
+        elif len(self.files) != len(current):
+            self.save()
+        return refreshed
+
+    def _range(self):
+        # First and last month with sales across all products
+        months = {m for state in self.products.values() for m in state["series"]}
+        return (min(months), max(months)) if months else (None, None)
+
+    def _extend(self, state, appended, last):
+        # O(1) state update per month after `last`. Returns False when the
+        # product needs a full refit instead.
+        if "alpha" not in state or state.get("fitted_through") != last \
+                or state.get("updates", 0) + len(appended) >= REFIT_EVERY:
+            return False
+        if not appended:
+            return True
+
+        alpha, beta = state["alpha"], state.get("beta", 0.0)
+        level, trend = state["level"], state.get("trend", 0.0)
+        for month in appended:
+            previous, level = level, alpha * state["series"].get(month, 0) + (1 - alpha) * (level + trend)
+            trend = beta * (level - previous) + (1 - beta) * trend
+        state["level"], state["trend"] = level, trend
+        state["updates"] = state.get("updates", 0) + len(appended)
+        state["fitted_through"] = appended[-1]
+        return True
+
+    def _refit(self, products, calendar):
+        # All products needing a refit are fitted together in one batch
+        if not products:
+            return
+        series = [[s.get(m, 0) for m in calendar] for s in (self.products[p]["series"] for p in products)]
+        Y, lengths = series_matrix(series)
+        fit = fit_ses(Y, lengths)
+        fit["beta"], fit["trend"] = np.zeros(len(products)), np.zeros(len(products))
+        long = np.flatnonzero(lengths >= HOLT_MIN_MONTHS)
+        if len(long):
+            holt = fit_holt(Y[long], lengths[long])
+            # AIC with 2 (SES) or 4 (Holt) parameters; the floor keeps perfect fits finite
+            aic = lambda sse, k: lengths[long] * np.log(np.maximum(sse, 1e-9) / lengths[long]) + 2 * k
+            better = long[aic(holt["sse"], 4) < aic(fit["sse"][long], 2)]
+            picked = np.searchsorted(long, better)
+            for key in FIT_KEYS:
+                fit[key][better] = holt[key][picked]
+        for i, product in enumerate(products):
+            state = self.products[product]
+            for key in FIT_KEYS:
+                state[key] = float(fit[key][i])
+            state["updates"] = 0
+            state["fitted_through"] = calendar[-1]
+
+    def predictions(self):
+        # Next month: level plus one step of trend (zero for SES), never below zero
+        return {p: max(0, round(s["level"] + s.get("trend", 0.0)))
+                for p, s in self.products.items() if "level" in s}
+
+    def top(self, n=3):
+        return dict(sorted(self.predictions().items(), key=lambda x: x[1], reverse=True)[:n])
+
+    def top_with_errors(self, n=3):
+        return {
+            p: {"forecast": qty, "rmse": round(self.products[p].get("rmse", 0.0), 2)}
+            for p, qty in self.top(n).items()
+        }
@@ -0,0 +1,33 @@
+import os
+import multiprocessing
+
+# ------------------------------
+# Pre-fork serving for the Flask API
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# ------------------------------
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# Insight requests are CPU-bound pandas work under the GIL, so throughput
+# scales with processes, one per core by default.
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "2"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+# Import the app (pandas, numpy, pyarrow, the insight code) once in the
+# master; workers share those pages copy-on-write instead of re-importing.
+preload_app = True
+
+# Recycle workers now and then so pandas memory growth stays bounded
+max_requests = 1000
+max_requests_jitter = 100
+
+def post_fork(server, worker):
+    # Background WhatsApp delivery threads must be started after fork. The
+    # send rate is split across workers so the total stays at the configured
+    # WHATSAPP_RATE_PER_SEC.
+    from wsgi import app
+
+    delivery = app.extensions["whatsapp"]
+    delivery.limiter.rate = delivery.limiter.rate / server.cfg.workers
+    delivery.start()
@@ -0,0 +1,82 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from data_cleaner import CLEANER_VERSION
+
+# ------------------------------
+# Config
+# ------------------------------
+CACHE_SIZE = int(os.getenv("INSIGHT_CACHE_SIZE", "256"))
+CACHE_TTL = float(os.getenv("INSIGHT_CACHE_TTL", "3600"))
+HASH_CHUNK = 1 << 20
+
+def upload_key(stream):
+    # SHA-256 of the uploaded bytes plus the cleaner version, read in chunks
+    # and rewound so the same stream can then be parsed.
+    h = hashlib.sha256(f"cleaner:{CLEANER_VERSION}\n".encode())
+    for chunk in iter(lambda: stream.read(HASH_CHUNK), b''):
+        h.update(chunk)
+    stream.seek(0)
+    return h.hexdigest()
+
+# ------------------------------
+# Bounded LRU + TTL cache
+# ------------------------------
+class InsightCache:
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                stored_at, value = item
+                if time.monotonic() - stored_at <= self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        # Two concurrent misses on the same key may both compute; the result
+        # is identical, so that is cheaper than holding a lock around pandas.
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
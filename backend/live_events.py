@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:      # Windows: one process per user folder only
+    fcntl = None
+
+from data_cleaner import clean_column_names, infer_schema
+from sales_frame import SalesAggregates
+from biz_insights import insights_from_aggregates, generate_personalized_advice
+from upload_store import STATE_DIR, state_path, write_json_atomic
+from metrics import inc
+
+# ------------------------------
+# Config
+# ------------------------------
+# data/<phone>/.vyapaar/events.jsonl         append-only log of normalised sale events
+# data/<phone>/.vyapaar/live_snapshot.json   counters + the log offset they cover
+EVENT_LOG = "events.jsonl"
+SNAPSHOT_FILE = "live_snapshot.json"
+LIVE_VERSION = 1
+SNAPSHOT_EVERY = int(os.getenv("LIVE_SNAPSHOT_EVERY", "1000"))     # events
+SNAPSHOT_SECS = float(os.getenv("LIVE_SNAPSHOT_SECS", "30"))
+MAX_EVENTS_PER_REQUEST = int(os.getenv("LIVE_MAX_EVENTS", "5000"))
+LOW_STOCK = 5
+EVENT_REQUIRED = ('product', 'quantity_sold', 'customer_id')
+EVENT_TEXT_FIELDS = ('store_location', 'salesperson', 'promotion_applied')
+
+# ------------------------------
+# Event validation
+# ------------------------------
+@lru_cache(maxsize=256)
+def _event_schema(keys):
+    # POS payloads use the same header aliases as CSV exports
+    return infer_schema(clean_column_names(keys))
+
+def _parse_date(value):
+    if value in (None, ""):
+        return datetime.date.today().isoformat()
+    text = str(value).strip().replace("Z", "+00:00")
+    return datetime.datetime.fromisoformat(text).date().isoformat()
+
+def normalize_event(raw):
+    # One POS sale -> {standard field: value}; raises ValueError when unusable
+    if not isinstance(raw, dict):
+        raise ValueError("Event must be a JSON object")
+    keys = tuple(raw)
+    col_map = _event_schema(keys)
+    missing = [f for f in EVENT_REQUIRED if f not in col_map]
+    if missing:
+        raise ValueError(f"Missing important fields: {missing}")
+    by_clean = dict(zip(clean_column_names(keys), raw.values()))
+    value = lambda field: by_clean[col_map[field]]
+
+    event = {
+        "product": str(value("product")).strip(),
+        "quantity_sold": int(float(value("quantity_sold"))),
+        "customer_id": str(value("customer_id")).strip(),
+        "date": _parse_date(value("date") if "date" in col_map else None),
+    }
+    if not event["product"] or not event["customer_id"]:
+        raise ValueError("'product' and 'customer_id' must not be empty")
+    if "unit_price" in col_map and value("unit_price") not in (None, ""):
+        event["unit_price"] = float(value("unit_price"))
+    if "stock_left" in col_map and value("stock_left") not in (None, ""):
+        event["stock_left"] = int(float(value("stock_left")))
+    for field in EVENT_TEXT_FIELDS:
+        if field in col_map and value(field) is not None:
+            event[field] = str(value(field)).strip()
+    return event
+
+# ------------------------------
+# Incremental counters
+# ------------------------------
+def _empty_state():
+    return {
+        "events": 0,
+        "products": {},          # product -> quantity
+        "revenue": {},           # product -> revenue
+        "customers": {},         # customer -> purchases, in first-seen order
+        "monthly": {},           # month -> quantity
+        "monthly_products": {},  # month -> {product: quantity}
+        "stock": {},             # product -> {"date", "stock"} (latest sale)
+        "date_range": None,
+    }
+
+def apply_event(state, event):
+    # O(1) dict updates per event
+    product, qty, date = event["product"], event["quantity_sold"], event["date"]
+    month = date[:7]
+    state["events"] += 1
+    state["products"][product] = state["products"].get(product, 0) + qty
+    if "unit_price" in event:
+        state["revenue"][product] = state["revenue"].get(product, 0.0) + qty * event["unit_price"]
+    customer = event["customer_id"]
+    state["customers"][customer] = state["customers"].get(customer, 0) + 1
+    state["monthly"][month] = state["monthly"].get(month, 0) + qty
+    bucket = state["monthly_products"].setdefault(month, {})
+    bucket[product] = bucket.get(product, 0) + qty
+    if "stock_left" in event:
+        seen = state["stock"].get(product)
+        if seen is None or date >= seen["date"]:
+            state["stock"][product] = {"date": date, "stock": event["stock_left"]}
+    first, last = state["date_range"] or (date, date)
+    state["date_range"] = [min(first, date), max(last, date)]
+
+# ------------------------------
+# Per-user live store
+# ------------------------------
+class LiveStore:
+    # Counters for one shop, kept in memory and in step with its event log.
+    # Every read or write first replays log lines appended since this
+    # process last looked (by other gunicorn workers, or before a restart),
+    # so all processes serve the same numbers. The log is locked with flock
+    # while appending or replaying.
+    def __init__(self, folder):
+        self.folder = folder
+        self.log_path = state_path(folder, EVENT_LOG)
+        self.snapshot_path = state_path(folder, SNAPSHOT_FILE)
+        self._lock = threading.Lock()
+        self._cached = None
+        self.state, self.offset = _empty_state(), 0
+        self._pending, self._snapshot_at = 0, time.monotonic()
+        self._load_snapshot()
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path) as f:
+                data = json.load(f)
+            size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+            # A snapshot past the end of the log belongs to an older log
+            if data.get("version") == LIVE_VERSION and data["offset"] <= size:
+                self.state, self.offset = data["state"], data["offset"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save_snapshot(self):
+        write_json_atomic(self.snapshot_path,
+                          {"version": LIVE_VERSION, "offset": self.offset, "state": self.state})
+        self._pending, self._snapshot_at = 0, time.monotonic()
+
+    def _maybe_snapshot(self):
+        if self._pending >= SNAPSHOT_EVERY or \
+                (self._pending and time.monotonic() - self._snapshot_at >= SNAPSHOT_SECS):
+            self.save_snapshot()
+
+    @contextmanager
+    def _locked_log(self):
+        with self._lock, open(self.log_path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._catch_up(f)
+                yield f
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _catch_up(self, f):
+        f.seek(self.offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                # Torn write from a crashed process: drop it before appending
+                f.truncate(self.offset)
+                break
+            apply_event(self.state, json.loads(line))
+            self.offset += len(line)
+            self._pending += 1
+
+    def ingest(self, raw_events):
+        # Validates, logs and applies a batch. Returns accepted/rejected
+        # counts; rejected events are not logged.
+        events, rejected = [], []
+        for i, raw in enumerate(raw_events):
+            try:
+                events.append(normalize_event(raw))
+            except (ValueError, TypeError, OverflowError) as e:
+                rejected.append({"index": i, "error": str(e)})
+        with self._locked_log() as f:
+            if events:
+                payload = b"".join(json.dumps(e, separators=(",", ":")).encode() + b"\n" for e in events)
+                f.seek(0, os.SEEK_END)
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+                for event in events:
+                    apply_event(self.state, event)
+                self.offset += len(payload)
+                self._pending += len(events)
+            self._maybe_snapshot()
+            total = self.state["events"]
+        inc("live_events_total", len(events), outcome="accepted")
+        inc("live_events_total", len(rejected), outcome="rejected")
+        return {"accepted": len(events), "rejected": rejected, "events": total}
+
+    def rebuild(self):
+        # Recompute every counter from the log (e.g. after a counting change)
+        with self._locked_log() as f:
+            self.state, self.offset, self._pending = _empty_state(), 0, 0
+            self._catch_up(f)
+            self.save_snapshot()
+            return self.state["events"]
+
+    def aggregates(self):
+        s = self.state
+        if not s["events"]:
+            return None
+        return SalesAggregates(
+            product_quantity=pd.Series(s["products"], dtype='int64').sort_index(),
+            low_stock_products=[p for p, v in s["stock"].items() if v["stock"] < LOW_STOCK] if s["stock"] else None,
+            customer_counts=pd.Series(s["customers"], dtype='int64').sort_values(ascending=False, kind='stable'),
+            monthly_quantity=pd.Series(s["monthly"], dtype='int64').sort_index(),
+            product_revenue=pd.Series(s["revenue"], dtype='float64').sort_index() if s["revenue"] else None,
+        )
+
+    def insights(self):
+        # Built from the counters (O(distinct keys)), and only again once new
+        # events have arrived
+        with self._locked_log():
+            self._maybe_snapshot()
+            events = self.state["events"]
+            if self._cached is None or self._cached[0] != events:
+                agg = self.aggregates()
+                insights = insights_from_aggregates(agg) if agg is not None else {}
+                self._cached = (events, {
+                    "insights": insights,
+                    "smart_suggestion": generate_personalized_advice(insights),
+                    "events": events,
+                    "date_range": self.state["date_range"],
+                })
+            return self._cached[1]
+
+# One LiveStore per user folder and process
+_stores = {}
+_stores_lock = threading.Lock()
+
+def live_store(folder):
+    with _stores_lock:
+        store = _stores.get(folder)
+        if store is None:
+            store = _stores[folder] = LiveStore(folder)
+        return store
+
+def has_events(folder):
+    return os.path.exists(os.path.join(folder, STATE_DIR, EVENT_LOG))
+
+# ------------------------------
+# CLI: python live_events.py rebuild <phone>
+# ------------------------------
+if __name__ == "__main__":
+    import sys
+    from upload_store import user_folder
+
+    if len(sys.argv) != 3 or sys.argv[1] != "rebuild":
+        sys.exit("usage: python live_events.py rebuild <phone>")
+    print(f"Rebuilt {LiveStore(user_folder(sys.argv[2])).rebuild()} event(s)")
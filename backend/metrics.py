@@ -0,0 +1,164 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# ------------------------------
+# Config
+# ------------------------------
+# Seconds; the same buckets serve pipeline stages, requests and Twilio calls
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = "vyapaar_"
+
+# Stage timings of the current request when profiling is on, else None
+_profile = ContextVar("vyapaar_profile", default=None)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+# ------------------------------
+# Registry
+# ------------------------------
+class Metrics:
+    # Counters and histograms kept in plain dicts behind one lock; recording
+    # is a dict update, so instrumentation stays cheap on the hot path.
+    # Values are per process (each gunicorn worker exposes its own).
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}      # name -> {label key: value}
+        self._histograms = {}    # name -> {label key: [bucket counts..., sum, count]}
+
+    def describe(self, name, help_text):
+        self._help[PREFIX + name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        name, key = PREFIX + name, _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        name, key = PREFIX + name, _label_key(labels)
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[slot] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            histograms = {n: {k: list(v) for k, v in s.items()} for n, s in self._histograms.items()}
+        return counters, histograms
+
+    def render(self, gauges=None):
+        # Prometheus text exposition format (version 0.0.4). gauges:
+        # {name: (help, value or {label dict as tuple: value})}, read at scrape time.
+        counters, histograms = self.snapshot()
+        lines = []
+        for name in sorted(counters):
+            lines += [f"# HELP {name} {self._help.get(name, name)}", f"# TYPE {name} counter"]
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name in sorted(histograms):
+            lines += [f"# HELP {name} {self._help.get(name, name)}", f"# TYPE {name} histogram"]
+            for key, state in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), state):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(key)} {round(state[-2], 6)}")
+                lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            name = PREFIX + name
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            values = value if isinstance(value, dict) else {(): value}
+            for key, v in sorted(values.items()):
+                lines.append(f"{name}{_format_labels(key)} {v}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+REGISTRY = Metrics()
+REGISTRY.describe("stage_seconds", "Time spent in each pipeline stage")
+REGISTRY.describe("stage_errors_total", "Pipeline stage failures by exception type")
+REGISTRY.describe("rows_processed_total", "Rows that went through the cleaner")
+REGISTRY.describe("upload_bytes_total", "Bytes of uploaded sales files received by the API")
+REGISTRY.describe("http_requests_total", "API requests by endpoint and status")
+REGISTRY.describe("http_request_seconds", "API request latency by endpoint")
+REGISTRY.describe("http_errors_total", "API errors by endpoint and exception type")
+REGISTRY.describe("twilio_send_seconds", "Latency of Twilio message sends")
+REGISTRY.describe("twilio_messages_total", "Twilio message sends by outcome")
+REGISTRY.describe("whatsapp_queue_errors_total", "WhatsApp queue database errors by type")
+REGISTRY.describe("live_events_total", "POS sale events received by outcome")
+
+# ------------------------------
+# Instrumentation helpers
+# ------------------------------
+def inc(name, value=1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+def observe(name, value, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+@contextmanager
+def stage(name):
+    # Times one pipeline stage; failures are counted by exception type and
+    # re-raised. A chunked stage is recorded once per chunk.
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        REGISTRY.inc("stage_errors_total", stage=name, error=type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        REGISTRY.observe("stage_seconds", elapsed, stage=name)
+        timings = _profile.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+# ------------------------------
+# Per-request profiling
+# ------------------------------
+def start_profile():
+    # Returns a token for stop_profile(); stages run until then are collected
+    return _profile.set([])
+
+def stop_profile(token):
+    # {"stages": {name: {"calls", "secs"}}} in first-seen order
+    timings = _profile.get() or []
+    _profile.reset(token)
+    stages = {}
+    for name, secs in timings:
+        s = stages.setdefault(name, {"calls": 0, "secs": 0.0})
+        s["calls"] += 1
+        s["secs"] += secs
+    for s in stages.values():
+        s["secs"] = round(s["secs"], 6)
+    return {"stages": stages}
+
+def server_timing(profile):
+    # Server-Timing header value, so browser dev tools show the breakdown too
+    return ", ".join(f"{name};dur={s['secs'] * 1000:.2f}" for name, s in profile["stages"].items())
@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+from functools import cached_property
+from data_cleaner import clean_and_map
+from metrics import stage
+
+# ------------------------------
+# SHARED AGGREGATES
+# ------------------------------
+class SalesAggregates:
+    # Everything the insight, advice and chart code reads from a sales file.
+    # A field is None when the columns it needs are not present.
+    def __init__(self, product_quantity=None, low_stock_products=None, customer_counts=None,
+                 monthly_quantity=None, product_revenue=None):
+        self.product_quantity = product_quantity
+        self.low_stock_products = low_stock_products
+        self.customer_counts = customer_counts
+        self.monthly_quantity = monthly_quantity
+        self.product_revenue = product_revenue
+
+    # Plain-JSON form so aggregates can be saved next to the uploads.
+    # Customer counts are cut to the top entries to keep the store compact.
+    def to_dict(self, max_customers=10):
+        def series(s, limit=None):
+            if s is None:
+                return None
+            s = s.head(limit) if limit else s
+            return {str(k): v.item() if hasattr(v, 'item') else v for k, v in s.items()}
+
+        return {
+            'product_quantity': series(self.product_quantity),
+            'low_stock_products': self.low_stock_products,
+            'customer_counts': series(self.customer_counts, max_customers),
+            'monthly_quantity': series(self.monthly_quantity),
+            'product_revenue': series(self.product_revenue),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        def series(d):
+            return pd.Series(d) if d is not None else None
+
+        return cls(
+            product_quantity=series(data.get('product_quantity')),
+            low_stock_products=data.get('low_stock_products'),
+            customer_counts=series(data.get('customer_counts')),
+            monthly_quantity=series(data.get('monthly_quantity')),
+            product_revenue=series(data.get('product_revenue')),
+        )
+
+def _is_categorical(s):
+    return isinstance(s.dtype, pd.CategoricalDtype)
+
+def bincount_sum(codes, weights, size):
+    # Per-code sums in one pass over integer codes (np.bincount); missing
+    # weights count as 0. Returns (sums, present) arrays of length `size`.
+    weights = np.asarray(weights, dtype='float64')
+    if np.isnan(weights).any():
+        weights = np.nan_to_num(weights)
+    sums = np.bincount(codes, weights=weights, minlength=size)
+    present = np.bincount(codes, minlength=size) > 0
+    return sums, present
+
+def _sum_by(keys, values):
+    # values summed per key, with plain sorted labels. Cleaned frames have
+    # categorical keys, summed over their codes with bincount_sum (about 3x
+    # faster than groupby); other keys fall back to groupby.
+    if not _is_categorical(keys):
+        return values.groupby(keys, observed=True).sum()
+    codes = keys.cat.codes.to_numpy()
+    if (codes < 0).any():
+        values, codes = values[codes >= 0], codes[codes >= 0]
+    sums, present = bincount_sum(codes, values.to_numpy(), len(keys.cat.categories))
+    dtype = 'int64' if values.dtype.kind in 'iub' else 'float64'
+    index = keys.cat.categories[present].astype(object).rename(keys.name)
+    return pd.Series(sums[present].astype(dtype), index=index, name=values.name).sort_index()
+
+def _value_counts(s, sort=True):
+    # value_counts on a categorical lists unused categories and breaks ties in
+    # category order; counting the codes keeps first-appearance tie order.
+    if not _is_categorical(s):
+        return s.value_counts(sort=sort)
+    counts = pd.Series(s.cat.codes[s.cat.codes >= 0]).value_counts(sort=sort)
+    counts.index = s.cat.categories[counts.index].astype(object)
+    return counts.rename_axis(s.name)
+
+# ------------------------------
+# CLEANED FRAME
+# ------------------------------
+class SalesFrame:
+    # A DataFrame that has been cleaned exactly once, plus its column mapping.
+    # Aggregates are computed on first access and shared by every consumer.
+    def __init__(self, df: pd.DataFrame, col_map: dict):
+        self.df = df
+        self.col_map = col_map
+
+    @classmethod
+    def from_raw(cls, df: pd.DataFrame, user_folder=None):
+        df, col_map = clean_and_map(df, user_folder)
+        return cls(df, col_map)
+
+    @classmethod
+    def wrap(cls, data):
+        return data if isinstance(data, cls) else cls.from_raw(data)
+
+    @property
+    def rows(self):
+        return len(self.df)
+
+    def has(self, *cols):
+        return set(cols).issubset(self.df.columns)
+
+    @cached_property
+    def product_quantity(self):
+        if not self.has('product', 'quantity_sold'):
+            return None
+        return _sum_by(self.df['product'], self.df['quantity_sold'])
+
+    @cached_property
+    def customer_counts(self):
+        if not self.has('customer_id'):
+            return None
+        return _value_counts(self.df['customer_id'])
+
+    @cached_property
+    def low_stock_products(self):
+        if not self.has('stock_left', 'product'):
+            return None
+        return self.df.loc[self.df['stock_left'] < 5, 'product'].dropna().unique().tolist()
+
+    @cached_property
+    def dates(self):
+        # Parsed sale dates, only for rows with a usable date and quantity
+        date_col = 'date' if 'date' in self.df.columns else \
+            next((col for col in self.df.columns if 'date' in col.lower()), None)
+        if not date_col or 'quantity_sold' not in self.df.columns:
+            return None
+        dates = self.df[date_col]
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, errors='coerce')
+        return dates[dates.notna() & self.df['quantity_sold'].notna()]
+
+    @cached_property
+    def months(self):
+        # Month label ("YYYY-MM") per dated row
+        return self.dates.dt.to_period("M").astype(str) if self.dates is not None else None
+
+    @cached_property
+    def date_range(self):
+        # (first, last) sale date as "YYYY-MM-DD", or None
+        if self.dates is None or self.dates.empty:
+            return None
+        return self.dates.min().strftime("%Y-%m-%d"), self.dates.max().strftime("%Y-%m-%d")
+
+    @cached_property
+    def monthly_quantity(self):
+        months = self.months
+        if months is None:
+            return None
+        qty = self.df.loc[months.index, 'quantity_sold']
+        return qty.groupby(months).sum().astype(int)
+
+    @cached_property
+    def monthly_product_quantity(self):
+        # {month: {product: quantity}}
+        months = self.months
+        if months is None or 'product' not in self.df.columns:
+            return None
+        rows = self.df.loc[months.index]
+        grouped = rows['quantity_sold'].groupby([months, rows['product']], observed=True).sum()
+        result = {}
+        for (month, product), qty in grouped.items():
+            result.setdefault(month, {})[product] = int(qty)
+        return result
+
+    @cached_property
+    def monthly_customer_counts(self):
+        # {month: {customer: purchases}}
+        months = self.months
+        if months is None or 'customer_id' not in self.df.columns:
+            return None
+        customers = self.df.loc[months.index, 'customer_id']
+        grouped = pd.DataFrame({'month': months, 'customer': customers}) \
+            .groupby(['month', 'customer'], observed=True).size()
+        result = {}
+        for (month, customer), n in grouped.items():
+            result.setdefault(month, {})[customer] = int(n)
+        return result
+
+    @cached_property
+    def latest_stock(self):
+        # {product: {"date", "stock"}} from each product's most recent row
+        # (by sale date when there is one, otherwise by file order)
+        if not self.has('product', 'stock_left'):
+            return None
+        rows = self.df[['product', 'stock_left']].dropna(subset=['product'])
+        dates = self.dates
+        if dates is not None and not dates.empty:
+            keep = dates.index.intersection(rows.index)
+            rows = rows.loc[keep].assign(date=dates.loc[keep].to_numpy()).sort_values('date', kind='stable')
+        last = rows.drop_duplicates('product', keep='last')
+        return {
+            str(row.product): {
+                "date": row.date.strftime("%Y-%m-%d") if "date" in last.columns else None,
+                "stock": int(row.stock_left),
+            }
+            for row in last.itertuples(index=False)
+        }
+
+    @cached_property
+    def sketches(self):
+        # Heavy-hitter summaries of product quantity and customer purchases,
+        # saved per upload so top-K over many uploads needs no raw rows
+        from sketches import HeavyHitters
+
+        return {
+            "products": HeavyHitters.from_counts(self.product_quantity).to_dict()
+            if self.product_quantity is not None else None,
+            "customers": HeavyHitters.from_counts(self.customer_counts).to_dict()
+            if self.customer_counts is not None else None,
+        }
+
+    @cached_property
+    def product_revenue(self):
+        if not self.has('product', 'quantity_sold', 'unit_price'):
+            return None
+        revenue = self.df['quantity_sold'] * self.df['unit_price']
+        return _sum_by(self.df['product'], revenue)
+
+    @cached_property
+    @stage("aggregate")
+    def aggregates(self):
+        return SalesAggregates(
+            product_quantity=self.product_quantity,
+            low_stock_products=self.low_stock_products,
+            customer_counts=self.customer_counts,
+            monthly_quantity=self.monthly_quantity,
+            product_revenue=self.product_revenue,
+        )
@@ -0,0 +1,134 @@
+import os
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from sales_frame import SalesFrame
+from biz_insights import insights_from_aggregates
+
+# ------------------------------
+# Config
+# ------------------------------
+SEGMENT_DIMENSIONS = ('store_location', 'salesperson', 'promotion_applied')
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", os.cpu_count() or 2))
+# Below this many rows, shipping segments to worker processes costs more
+# than it saves, so they are computed in-process
+SEGMENT_PARALLEL_ROWS = int(os.getenv("SEGMENT_PARALLEL_ROWS", "500000"))
+PROMO_VALUES = frozenset({'yes', 'y', 'true', '1', 'applied'})
+
+def _promo_flags(s):
+    # Boolean per row; evaluated once per distinct value, not per row
+    values = s.astype('category') if not isinstance(s.dtype, pd.CategoricalDtype) else s
+    promo = values.cat.categories.astype(str).str.strip().str.lower().isin(PROMO_VALUES)
+    codes = values.cat.codes.to_numpy()
+    return pd.Series(promo[codes] & (codes >= 0), index=s.index)
+
+def _revenue(df):
+    return df['quantity_sold'] * df['unit_price'] if 'unit_price' in df.columns else None
+
+def _totals(df):
+    revenue = _revenue(df)
+    return {
+        "rows": len(df),
+        "quantity": int(df['quantity_sold'].sum()),
+        "revenue": round(float(revenue.sum()), 2) if revenue is not None else None,
+        "customers": int(df['customer_id'].nunique()),
+    }
+
+# ------------------------------
+# Promotion lift
+# ------------------------------
+def promotion_lift(df):
+    # Promotion vs no-promotion sales per transaction; lift is the change in
+    # average quantity (and revenue) per sale with a promotion applied
+    if 'promotion_applied' not in df.columns:
+        return None
+    flags = _promo_flags(df['promotion_applied'])
+    groups = {}
+    for name, rows in (("promotion", df[flags]), ("no_promotion", df[~flags])):
+        group = _totals(rows)
+        group["avg_quantity"] = round(group["quantity"] / group["rows"], 2) if group["rows"] else None
+        group["avg_revenue"] = round(group["revenue"] / group["rows"], 2) \
+            if group["rows"] and group["revenue"] is not None else None
+        groups[name] = group
+
+    def lift(metric):
+        promo, base = groups["promotion"][metric], groups["no_promotion"][metric]
+        return round((promo - base) / base * 100, 1) if promo is not None and base else None
+
+    return {**groups, "quantity_lift_pct": lift("avg_quantity"), "revenue_lift_pct": lift("avg_revenue")}
+
+# ------------------------------
+# Per-segment kernel (may run in a worker process)
+# ------------------------------
+def segment_summary(df):
+    sf = SalesFrame(df, {col: col for col in df.columns})
+    return {
+        **_totals(df),
+        "insights": insights_from_aggregates(sf.aggregates),
+        "promotion": promotion_lift(df),
+    }
+
+# ------------------------------
+# Worker pool (started on first use, shared by later calls)
+# ------------------------------
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool(workers):
+    # Starting workers (and importing pandas in them) takes about a second,
+    # so one pool is kept for the life of the process
+    from batch_upload import pool_context
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=pool_context())
+            atexit.register(_pool.shutdown, cancel_futures=True)
+        return _pool
+
+# ------------------------------
+# Segmented insights
+# ------------------------------
+def segment_insights(data, by='store_location', workers=SEGMENT_WORKERS):
+    # Partitions a cleaned frame by one dimension and runs the insight kernels
+    # per segment on a process pool, while the parent computes the rollup
+    # over the whole frame. Segments are listed by quantity, largest first.
+    if by not in SEGMENT_DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {by} (expected one of {list(SEGMENT_DIMENSIONS)})")
+    sf = SalesFrame.wrap(data)
+    df = sf.df
+    if by not in df.columns:
+        raise ValueError(f"Missing column for segmenting: {by}")
+
+    names, parts = [], []
+    for name, part in df.groupby(by, observed=True, sort=True):
+        names.append(str(name))
+        parts.append(part)
+
+    workers = max(1, min(workers, len(parts)))
+    if workers == 1 or len(df) < SEGMENT_PARALLEL_ROWS:
+        summaries = list(map(segment_summary, parts))
+        rollup = segment_summary(df)
+    else:
+        try:
+            futures = [_get_pool(workers).submit(segment_summary, part) for part in parts]
+            rollup = segment_summary(df)
+            summaries = [f.result() for f in futures]
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory): start a fresh pool next time
+            global _pool
+            with _pool_lock:
+                _pool = None
+            raise
+
+    segments = []
+    for name, summary in zip(names, summaries):
+        share = summary["quantity"] / rollup["quantity"] * 100 if rollup["quantity"] else None
+        segments.append({"segment": name, "share_pct": round(share, 1) if share is not None else None,
+                         **summary})
+    segments.sort(key=lambda s: (-s["quantity"], s["segment"]))
+    return {"dimension": by, "segments": segments, "rollup": rollup}
@@ -0,0 +1,98 @@
+import os
+import numpy as np
+import pandas as pd
+
+# ------------------------------
+# Config
+# ------------------------------
+# Counters kept per sketch. Any key whose true weight is more than
+# total / (SKETCH_CAPACITY + 1) is guaranteed to be in the sketch.
+SKETCH_CAPACITY = int(os.getenv("SKETCH_CAPACITY", "1024"))
+
+# ------------------------------
+# Heavy hitters (mergeable Misra-Gries / Space-Saving summary)
+# ------------------------------
+class HeavyHitters:
+    # Keeps at most `capacity` weighted counters, whatever the number of
+    # distinct keys. Error bounds, with N the total weight added:
+    #   true - error_bound <= estimate(key) <= true
+    #   error_bound <= (N - sum of kept counters) / (capacity + 1) <= N / (capacity + 1)
+    # Merging two sketches keeps the same bound over the combined weight
+    # (Agarwal et al., "Mergeable Summaries"), so per-upload sketches combine
+    # into top-K over any set of uploads. Weights must be non-negative;
+    # negative quantities (returns) are ignored.
+    def __init__(self, capacity=SKETCH_CAPACITY, counters=None, total=0):
+        self.capacity = int(capacity)
+        self.counters = counters if counters is not None else pd.Series(dtype='int64')
+        self.total = int(total)
+
+    @classmethod
+    def from_counts(cls, counts, capacity=SKETCH_CAPACITY):
+        return cls(capacity).update_counts(counts)
+
+    def update_counts(self, counts):
+        # counts: Series or dict {key: weight}, e.g. one chunk's value_counts()
+        counts = pd.Series(counts, dtype='int64') if isinstance(counts, dict) else counts
+        counts = counts[counts > 0].astype('int64')
+        if counts.empty:
+            return self
+        counts.index = counts.index.astype(object)
+        counts = counts.groupby(level=0, sort=False).sum()
+        self.total += int(counts.sum())
+        merged = self.counters.add(counts, fill_value=0) if len(self.counters) else counts
+        self.counters = merged.astype('int64')
+        self._prune()
+        return self
+
+    def merge(self, other):
+        # The bound only holds for the smaller capacity of the two
+        self.capacity = min(self.capacity, other.capacity)
+        self.total += other.total
+        self.counters = self.counters.add(other.counters, fill_value=0).astype('int64') \
+            if len(self.counters) else other.counters.copy()
+        self._prune()
+        return self
+
+    def _prune(self):
+        # Subtract the (capacity+1)-th largest count from every counter and
+        # drop those that reach zero: at most `capacity` survive
+        if len(self.counters) <= self.capacity:
+            return
+        values = self.counters.to_numpy()
+        cut = np.partition(values, -(self.capacity + 1))[-(self.capacity + 1)]
+        kept = self.counters - cut
+        self.counters = kept[kept > 0]
+
+    @property
+    def error_bound(self):
+        return (self.total - int(self.counters.sum())) // (self.capacity + 1)
+
+    def estimate(self, key):
+        return int(self.counters.get(key, 0))
+
+    def top(self, n=None):
+        # Series of the n largest estimates, ties broken by key
+        ranked = sorted(self.counters.items(), key=lambda kv: (-kv[1], str(kv[0])))
+        ranked = ranked[:n] if n is not None else ranked
+        return pd.Series({str(k): int(v) for k, v in ranked}, dtype='int64')
+
+    def to_dict(self):
+        return {
+            "capacity": self.capacity,
+            "total": self.total,
+            "counters": {str(k): int(v) for k, v in self.counters.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        counters = pd.Series(data.get("counters") or {}, dtype='int64')
+        counters.index = counters.index.astype(object)
+        return cls(data.get("capacity", SKETCH_CAPACITY), counters, data.get("total", 0))
+
+def merge_sketches(sketches, capacity=SKETCH_CAPACITY):
+    # Serialised sketches (to_dict() form) -> one HeavyHitters
+    merged = HeavyHitters(capacity)
+    for data in sketches:
+        if data:
+            merged.merge(HeavyHitters.from_dict(data))
+    return merged
@@ -0,0 +1,210 @@
+import os
+import pandas as pd
+
+from data_cleaner import clean_and_map, clean_column_names, resolve_schema
+from sales_frame import SalesFrame, SalesAggregates, _value_counts
+from biz_insights import insights_from_aggregates
+from metrics import stage
+from sketches import HeavyHitters
+
+# ------------------------------
+# Config
+# ------------------------------
+CHUNK_ROWS = 100_000
+# Sketch mode: top products and frequent customers come from fixed-size
+# heavy-hitter sketches instead of exact per-key counts (see sketches.py)
+SKETCH_MODE = os.getenv("SKETCH_MODE") == "1"
+
+# ------------------------------
+# Chunked reading
+# ------------------------------
+def iter_clean_chunks(source, chunksize=CHUNK_ROWS, user_folder=None):
+    # Yields (cleaned chunk, col_map); only one chunk is held in memory at a time.
+    # The header schema (and date format) is resolved once, from the first
+    # chunk, and reused for every later chunk.
+    reader = pd.read_csv(source, chunksize=chunksize)
+    schema = None
+    while True:
+        with stage("read_csv"):
+            chunk = next(reader, None)
+        if chunk is None:
+            return
+        if schema is None:
+            chunk.columns = clean_column_names(chunk.columns)
+            schema = resolve_schema(chunk, user_folder)
+        yield clean_and_map(chunk, user_folder, schema)
+
+# ------------------------------
+# Streaming Aggregator
+# ------------------------------
+class StreamingAggregator:
+    # Builds the same aggregates as SalesFrame, chunk by chunk. Memory is
+    # bounded by the number of distinct products, customers and months,
+    # not by the number of rows. With sketch=True, product totals and
+    # customer counts are kept in HeavyHitters sketches instead: memory no
+    # longer grows with distinct customers, counts may be under-estimated by
+    # at most the sketch's error_bound, and per-customer monthly partials
+    # (which need every customer) are not kept.
+    def __init__(self, sketch=SKETCH_MODE):
+        self.rows = 0
+        self.sketch = sketch
+        self._product_sketch = HeavyHitters()
+        self._customer_sketch = HeavyHitters()
+        self._product_qty = None
+        self._product_rev = None
+        self._low_stock = {}
+        self._customers = {}
+        self._monthly = {}
+        self._monthly_product = {}
+        self._monthly_customers = {}
+        self._latest_stock = {}
+        self._date_range = None
+        self._has = {'low_stock': False, 'customers': False, 'monthly': False, 'revenue': False,
+                     'stock': False, 'products': False}
+
+    @staticmethod
+    def _add(total, part):
+        return part if total is None else total.add(part, fill_value=0)
+
+    @stage("aggregate")
+    def add(self, df: pd.DataFrame, col_map: dict = None):
+        sf = SalesFrame(df, col_map or {})
+        self.rows += len(df)
+
+        if sf.product_quantity is not None:
+            if self.sketch:
+                self._has['products'] = True
+                self._product_sketch.update_counts(sf.product_quantity)
+            else:
+                self._product_qty = self._add(self._product_qty, sf.product_quantity)
+        if sf.product_revenue is not None:
+            self._has['revenue'] = True
+            self._product_rev = self._add(self._product_rev, sf.product_revenue)
+        if sf.low_stock_products is not None:
+            self._has['low_stock'] = True
+            self._low_stock.update(dict.fromkeys(sf.low_stock_products))
+        if sf.has('customer_id'):
+            # Unsorted counts keep first-appearance order; value_counts on the
+            # full frame breaks ties the same way (stable sort).
+            self._has['customers'] = True
+            counts = _value_counts(df['customer_id'], sort=False)
+            if self.sketch:
+                self._customer_sketch.update_counts(counts)
+            else:
+                for customer, n in counts.items():
+                    self._customers[customer] = self._customers.get(customer, 0) + int(n)
+        if sf.date_range is not None:
+            first, last = sf.date_range
+            if self._date_range is not None:
+                first, last = min(first, self._date_range[0]), max(last, self._date_range[1])
+            self._date_range = (first, last)
+        if sf.monthly_quantity is not None:
+            self._has['monthly'] = True
+            for month, qty in sf.monthly_quantity.items():
+                self._monthly[month] = self._monthly.get(month, 0) + int(qty)
+            for month, sales in (sf.monthly_product_quantity or {}).items():
+                bucket = self._monthly_product.setdefault(month, {})
+                for product, qty in sales.items():
+                    bucket[product] = bucket.get(product, 0) + qty
+            monthly_customers = None if self.sketch else sf.monthly_customer_counts
+            for month, counts in (monthly_customers or {}).items():
+                bucket = self._monthly_customers.setdefault(month, {})
+                for customer, n in counts.items():
+                    bucket[customer] = bucket.get(customer, 0) + n
+        if sf.latest_stock is not None:
+            # Later chunks win ties, as the last row of the whole file would
+            self._has['stock'] = True
+            for product, stock in sf.latest_stock.items():
+                seen = self._latest_stock.get(product)
+                if seen is None or (stock["date"] or "") >= (seen["date"] or ""):
+                    self._latest_stock[product] = stock
+        return self
+
+    @property
+    def product_quantity(self):
+        if self.sketch:
+            return self._product_sketch.top().sort_index() if self._has['products'] else None
+        if self._product_qty is None:
+            return None
+        return self._product_qty.sort_index().astype('int64')
+
+    @property
+    def product_revenue(self):
+        return self._product_rev.sort_index() if self._has['revenue'] else None
+
+    @property
+    def low_stock_products(self):
+        return list(self._low_stock) if self._has['low_stock'] else None
+
+    @property
+    def customer_counts(self):
+        if not self._has['customers']:
+            return None
+        if self.sketch:
+            return self._customer_sketch.top()
+        counts = pd.Series(self._customers, dtype='int64')
+        return counts.sort_values(ascending=False, kind='stable')
+
+    @property
+    def monthly_quantity(self):
+        if not self._has['monthly']:
+            return None
+        return pd.Series(self._monthly, dtype='int64').sort_index()
+
+    @property
+    def monthly_product_quantity(self):
+        return {m: self._monthly_product[m] for m in sorted(self._monthly_product)} \
+            if self._has['monthly'] else None
+
+    @property
+    def monthly_customer_counts(self):
+        return {m: self._monthly_customers[m] for m in sorted(self._monthly_customers)} \
+            if self._has['monthly'] and self._has['customers'] and not self.sketch else None
+
+    @property
+    def sketches(self):
+        # Per-upload heavy-hitter summaries; in exact mode they are built from
+        # the exact counts, so both modes store the same kind of sketch
+        if self.sketch:
+            products = self._product_sketch if self._has['products'] else None
+            customers = self._customer_sketch if self._has['customers'] else None
+        else:
+            products = HeavyHitters.from_counts(self._product_qty) if self._product_qty is not None else None
+            customers = HeavyHitters.from_counts(self._customers) if self._has['customers'] else None
+        return {
+            "products": products.to_dict() if products is not None else None,
+            "customers": customers.to_dict() if customers is not None else None,
+        }
+
+    @property
+    def latest_stock(self):
+        return self._latest_stock if self._has['stock'] else None
+
+    @property
+    def date_range(self):
+        return self._date_range
+
+    @property
+    def aggregates(self):
+        return SalesAggregates(
+            product_quantity=self.product_quantity,
+            low_stock_products=self.low_stock_products,
+            customer_counts=self.customer_counts,
+            monthly_quantity=self.monthly_quantity,
+            product_revenue=self.product_revenue,
+        )
+
+# ------------------------------
+# Entry points
+# ------------------------------
+def stream_aggregate(source, chunksize=CHUNK_ROWS, sink=None, user_folder=None, sketch=SKETCH_MODE):
+    # sink(df, col_map) is called for every cleaned chunk, e.g. to persist it
+    agg = StreamingAggregator(sketch)
+    for df, col_map in iter_clean_chunks(source, chunksize, user_folder):
+        agg.add(df, col_map)
+        if sink is not None:
+            sink(df, col_map)
+    return agg
+
+def stream_insights(source, chunksize=CHUNK_ROWS, sketch=SKETCH_MODE):
+    return insights_from_aggregates(stream_aggregate(source, chunksize, sketch=sketch).aggregates)
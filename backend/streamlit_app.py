@@ -1,35 +1,31 @@
 import streamlit as st
-import pandas as pd
-import json
 import os
 import datetime
 import requests
 
-from biz_insights import (
-    generate_insights,
-    generate_personalized_advice,
-    forecast_top_products,
-    generate_sales_plot,
-    generate_top_product_pie,
-    generate_top_customers_plot
-)
-from data_cleaner import clean_dataframe
+from batch_upload import process_batch
+from biz_insights import add_basket_suggestions, forecast_top_products, generate_personalized_advice
+from charts import render_chart
+from streaming import stream_aggregate
+from upload_store import UploadStore, UploadWriter, load_upload, new_upload_name, user_folder
+from segments import SEGMENT_DIMENSIONS, segment_insights
+from forecaster import MIN_MONTHS, month_range
+from user_registry import UserRegistry
 
 # ------------------------------
 # Config
 # ------------------------------
 TWILIO_API_URL = "http://localhost:5000/send-whatsapp"
-USER_DB = "users.json"
+HISTORY_PAGE_SIZE = 10
 
 # ------------------------------
-# Load or Initialize User Data
+# User Registry (SQLite; imports users.json on first run)
 # ------------------------------
-if not os.path.exists(USER_DB):
-    with open(USER_DB, "w") as f:
-        json.dump({}, f)
+@st.cache_resource
+def get_user_registry():
+    return UserRegistry()
 
-with open(USER_DB, "r") as f:
-    users = json.load(f)
+users = get_user_registry()
 
 # ------------------------------
 # App Title
@@ -60,9 +56,7 @@ if 'user_phone' not in st.session_state:
         name = name.strip()
         phone = phone.strip().replace(" ", "")
         if name and phone.startswith("+91") and len(phone) == 13 and phone[1:].isdigit():
-            users[phone] = {"name": name}
-            with open(USER_DB, "w") as f:
-                json.dump(users, f, indent=2)
+            users.upsert(phone, name)
             st.session_state.user_phone = phone
             st.success(f"Registered {name} ({phone}) successfully.")
             st.rerun()
@@ -75,20 +69,28 @@ if 'user_phone' not in st.session_state:
 if 'user_phone' in st.session_state:
     st.header("Upload Monthly Sales CSV")
 
-    uploaded_file = st.file_uploader("Upload your sales .csv file", type=["csv"])
+    uploaded_files = st.file_uploader("Upload your sales .csv files (or a .zip of monthly exports)",
+                                      type=["csv", "zip"], accept_multiple_files=True)
     phone = st.session_state.user_phone
-    folder_path = os.path.join("data", phone)
+    folder_path = user_folder(phone)
     os.makedirs(folder_path, exist_ok=True)
+    store = UploadStore(folder_path)
 
-    if uploaded_file and not st.session_state.get("upload_handled"):
-        try:
-            raw_df = pd.read_csv(uploaded_file)
-            df = clean_dataframe(raw_df)
+    single_csv = len(uploaded_files or []) == 1 and uploaded_files[0].name.lower().endswith(".csv")
 
+    if single_csv and not st.session_state.get("upload_handled"):
+        uploaded_file = uploaded_files[0]
+        try:
             timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = f"{timestamp}.csv"
+            filename = new_upload_name(timestamp)
             save_path = os.path.join(folder_path, filename)
-            df.to_csv(save_path, index=False)
+
+            # Clean, save and aggregate chunk by chunk so large exports never
+            # sit in memory whole; reruns read the stored results
+            with UploadWriter(save_path) as writer:
+                agg = stream_aggregate(uploaded_file, sink=lambda df, _: writer.write(df),
+                                       user_folder=folder_path)
+            store.add(filename, agg)
 
             st.success(f"Uploaded and saved as `{filename}`")
             st.session_state.upload_handled = True
@@ -98,72 +100,169 @@ if 'user_phone' in st.session_state:
             st.error("Failed to process the uploaded file.")
             st.code(str(e))
 
+    elif uploaded_files and not st.session_state.get("upload_handled"):
+        # Several files or an archive: analysed in parallel and saved together
+        try:
+            with st.spinner(f"Analysing {len(uploaded_files)} upload(s)..."):
+                result = process_batch([(f.name, f) for f in uploaded_files], folder_path)
+            st.session_state.batch_result = result
+            st.session_state.upload_handled = True
+            st.rerun()
+        except Exception as e:
+            st.error("Failed to process the uploaded files.")
+            st.code(str(e))
+
+    batch_result = st.session_state.pop("batch_result", None)
+    if batch_result:
+        st.success(f"Saved {batch_result['saved']} file(s) from the batch")
+        for item in batch_result["files"]:
+            if "error" in item:
+                st.warning(f"`{item['source']}` was skipped: {item['error']}")
+        combined = batch_result["combined"]
+        if combined:
+            st.subheader("Batch Summary")
+            st.write(f"{combined['rows']} rows across {combined['files']} file(s)"
+                     + (f", {combined['date_range'][0]} to {combined['date_range'][1]}"
+                        if combined['date_range'] else ""))
+            st.dataframe(combined["top_products"], hide_index=True)
+
     # ------------------------------
     # Show Insights from All Files
     # ------------------------------
     st.header("Past Uploads – Smart Insights")
-    all_files = sorted(os.listdir(folder_path))
-
-    if all_files:
-        for file in all_files:
-            with st.expander(f"{file}"):
-                try:
-                    df = pd.read_csv(os.path.join(folder_path, file))
-                    df = clean_dataframe(df)
-
-                    insights = generate_insights(df)
-                    suggestion = generate_personalized_advice(insights)
-
-                    st.subheader("Key Insights")
-                    st.json(insights)
-
-                    st.subheader("Personalized Suggestions")
-                    st.success(suggestion)
-
-                    # Visual Trends
-                    st.markdown("### Visual Trends")
-                    sales_plot = generate_sales_plot(df)
-                    pie_chart = generate_top_product_pie(df)
-                    top_customers = generate_top_customers_plot(df)
-
-                    if sales_plot:
-                        st.image(sales_plot, caption="Monthly Sales Trend")
-                    if pie_chart:
-                        st.image(pie_chart, caption="Top 5 Products (Sales %)")
-                    if top_customers:
-                        st.image(top_customers, caption="Top 5 Customers")
-
-                    # WhatsApp Button
-                    if st.button(f"Send summary on WhatsApp", key=file):
-                        try:
-                            res = requests.post(
-                                TWILIO_API_URL,
-                                json={"phone": phone, "message": f"Summary for {file}:\n{suggestion}"}
-                            )
-                            if res.status_code == 200:
-                                st.success("Summary sent via WhatsApp.")
-                            else:
-                                st.error("Failed to send the summary.")
-                        except Exception as e:
-                            st.warning("WhatsApp API error")
-                            st.code(str(e))
-                except Exception as e:
+    entries = store.sync()
+
+    if entries:
+        # Cheap index from the store: nothing is analysed or drawn here
+        history = list(reversed(entries))
+        st.dataframe(
+            [{
+                "file": e["file"],
+                "rows": e.get("rows"),
+                "from": (e.get("date_range") or [None, None])[0],
+                "to": (e.get("date_range") or [None, None])[1],
+                "status": "error" if "error" in e else "ok",
+            } for e in history],
+            hide_index=True,
+        )
+
+        pages = (len(history) - 1) // HISTORY_PAGE_SIZE + 1
+        page = st.number_input("Page", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+        start = (page - 1) * HISTORY_PAGE_SIZE
+
+        # Per-session memo of opened uploads, keyed by content hash
+        memo = st.session_state.setdefault("history_memo", {})
+        # Basket suggestions span all uploads, so a new upload refreshes them
+        shop_key = tuple((e["file"], e["sha256"]) for e in entries if "error" not in e)
+        # Drop what belongs to removed uploads or an older set of uploads, so
+        # the memo stays at one analysis (plus breakdowns) per current upload
+        current = set(shop_key)
+        for key in [k for k in memo if k[:2] not in current or (isinstance(k[2], tuple) and k[2] != shop_key)]:
+            del memo[key]
+
+        for entry in history[start:start + HISTORY_PAGE_SIZE]:
+            file = entry["file"]
+            # A toggle (unlike st.expander) lets us skip the work while closed
+            if not st.toggle(f"{file}", key=f"open_{file}"):
+                continue
+
+            with st.container(border=True):
+                if "error" in entry:
                     st.error(f"Could not read or analyze: {file}")
-                    st.code(str(e))
+                    st.code(entry["error"])
+                    continue
+
+                memo_key = (file, entry["sha256"], shop_key)
+                if memo_key not in memo:
+                    agg = store.aggregates(file)
+                    # Raw PNG bytes from the chart cache; redrawn only if the data changed
+                    insights = add_basket_suggestions(entry["insights"], folder_path, entries)
+                    memo[memo_key] = {
+                        "insights": insights,
+                        "advice": generate_personalized_advice(insights) if insights is not entry["insights"]
+                                  else entry["advice"],
+                        "charts": {kind: render_chart(kind, agg)
+                                   for kind in ("sales_trend", "top_products", "top_customers")},
+                    }
+                analysis = memo[memo_key]
+                insights = analysis["insights"]
+                suggestion = analysis["advice"]
+
+                st.subheader("Key Insights")
+                st.json(insights)
+
+                st.subheader("Personalized Suggestions")
+                st.success(suggestion)
+
+                # Per store / salesperson breakdown, read from the upload on demand
+                by = st.selectbox("Break down by", ["—", *SEGMENT_DIMENSIONS], key=f"segment_{file}")
+                if by != "—":
+                    seg_key = (file, entry["sha256"], by)
+                    if seg_key not in memo:
+                        try:
+                            memo[seg_key] = segment_insights(load_upload(os.path.join(folder_path, file)), by)
+                        except ValueError as e:
+                            memo[seg_key] = {"error": str(e)}
+                    segmented = memo[seg_key]
+                    if "error" in segmented:
+                        st.warning(segmented["error"])
+                    else:
+                        st.dataframe(
+                            [{k: s[k] for k in ("segment", "rows", "quantity", "revenue", "customers", "share_pct")}
+                             for s in segmented["segments"]],
+                            hide_index=True,
+                        )
+                        promo = segmented["rollup"]["promotion"]
+                        if promo and promo["quantity_lift_pct"] is not None:
+                            st.caption(f"Promotion lift: {promo['quantity_lift_pct']:+}% quantity per sale, "
+                                       f"{promo['revenue_lift_pct'] or 0:+}% revenue per sale")
+
+                # Visual Trends
+                st.markdown("### Visual Trends")
+                sales_plot = analysis["charts"]["sales_trend"]
+                pie_chart = analysis["charts"]["top_products"]
+                top_customers = analysis["charts"]["top_customers"]
+
+                if sales_plot:
+                    st.image(sales_plot, caption="Monthly Sales Trend")
+                if pie_chart:
+                    st.image(pie_chart, caption="Top 5 Products (Sales %)")
+                if top_customers:
+                    st.image(top_customers, caption="Top 5 Customers")
+
+                # WhatsApp Button
+                if st.button(f"Send summary on WhatsApp", key=file):
+                    try:
+                        res = requests.post(
+                            TWILIO_API_URL,
+                            json={"phone": phone, "message": f"Summary for {file}:\n{suggestion}"}
+                        )
+                        if res.status_code in (200, 202):
+                            st.success("Summary queued for WhatsApp delivery.")
+                        else:
+                            st.error("Failed to send the summary.")
+                    except Exception as e:
+                        st.warning("WhatsApp API error")
+                        st.code(str(e))
     else:
         st.info("No past uploads found.")
 
     # ------------------------------
-    # Forecasting (3+ files)
+    # Forecasting (3+ months of sales)
     # ------------------------------
     st.header("Sales Forecast for Next Month")
-    if len(all_files) >= 3:
+    sales_months = {m for entry in entries if "error" not in entry for m in entry["sales_months"]}
+    if sales_months and len(month_range(min(sales_months), max(sales_months))) >= MIN_MONTHS:
         forecast = forecast_top_products(folder_path)
         if "error" in forecast:
             st.warning(f"Forecasting failed: {forecast['error']}")
         elif forecast:
             st.success("Predicted Top Products:")
-            st.json(forecast)
+            st.dataframe(
+                [{"product": p, "forecast": f["forecast"], "typical error (± units)": f["rmse"]}
+                 for p, f in forecast.items()],
+                hide_index=True,
+            )
         else:
             st.info("No clear trend found for forecasting.")
     else:
@@ -0,0 +1,233 @@
+import os
+import json
+import zipfile
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:      # Windows: one writer per user folder only
+    fcntl = None
+
+from sales_frame import bincount_sum
+from upload_store import UploadStore, load_upload, state_path, write_json_atomic
+
+# ------------------------------
+# Layout
+# ------------------------------
+# data/<phone>/.vyapaar/symbols.json           {"version", "product": [...], "customer_id": [...]}
+# data/<phone>/.vyapaar/codes/<upload>.npz     one upload's aggregates, indexed by those codes
+SYMBOL_FILE = "symbols.json"
+CODES_DIR = "codes"
+SYMBOLS_VERSION = 1
+CODED_VERSION = 3
+KINDS = ("product", "customer_id")
+
+# ------------------------------
+# Symbol table
+# ------------------------------
+class SymbolTable:
+    # Stable integer codes for one shop's product and customer names, shared
+    # by all of its uploads. Codes are append-only (a name keeps its code
+    # forever), so arrays indexed by code from different months line up and
+    # merge with plain array addition. Only distinct names are looked up;
+    # rows are mapped with one NumPy take over the category codes.
+    def __init__(self, folder):
+        self.path = state_path(folder, SYMBOL_FILE)
+        self.symbols = {kind: [] for kind in KINDS}
+        self._index = {kind: {} for kind in KINDS}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != SYMBOLS_VERSION:
+            return
+        for kind in KINDS:
+            self.symbols[kind] = data.get(kind, [])
+            self._index[kind] = {name: code for code, name in enumerate(self.symbols[kind])}
+
+    def save(self):
+        write_json_atomic(self.path, {"version": SYMBOLS_VERSION, **self.symbols})
+        self._dirty = False
+
+    @contextmanager
+    def locked(self):
+        # Re-reads the table under an exclusive lock and saves new names on
+        # exit, so processes encoding uploads at once never hand out the
+        # same code twice
+        with open(self.path + ".lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._load()
+                yield self
+                if self._dirty:
+                    self.save()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def size(self, kind):
+        return len(self.symbols[kind])
+
+    def codes_for(self, kind, names):
+        # Distinct names -> int64 codes, adding names not seen before
+        index, symbols = self._index[kind], self.symbols[kind]
+        codes = np.empty(len(names), dtype='int64')
+        for i, name in enumerate(names):
+            code = index.get(name)
+            if code is None:
+                code = index[name] = len(symbols)
+                symbols.append(name)
+                self._dirty = True
+            codes[i] = code
+        return codes
+
+    def encode(self, kind, s):
+        # Series of names -> array of codes (-1 where missing)
+        cat = s if isinstance(s.dtype, pd.CategoricalDtype) else s.astype('category')
+        mapping = self.codes_for(kind, [str(c) for c in cat.cat.categories])
+        local = cat.cat.codes.to_numpy()
+        return np.where(local >= 0, mapping[np.maximum(local, 0)], -1) if len(mapping) else \
+            np.full(len(local), -1, dtype='int64')
+
+    def code(self, kind, name):
+        # Code of a known name, or None
+        return self._index[kind].get(name)
+
+    def decode(self, kind, codes):
+        symbols = self.symbols[kind]
+        return [symbols[c] for c in codes]
+
+# ------------------------------
+# Coded per-upload aggregates
+# ------------------------------
+def _pad(values, size):
+    return values if len(values) >= size else np.pad(values, (0, size - len(values)))
+
+def encode_upload(sf, table):
+    # One upload -> arrays indexed by the shop's global codes:
+    #   product_quantity / product_revenue / customer_counts   (bincount kernels)
+    #   monthly_quantity                                        months x products
+    #   month_customers + month_offsets                         sorted customer codes per month
+    #   basket_customers / basket_products / basket_quantity    quantity per (customer, product)
+    df = sf.df
+    products = table.encode("product", df['product'])
+    customers = table.encode("customer_id", df['customer_id'])
+    n_products, n_customers = table.size("product"), table.size("customer_id")
+    qty = df['quantity_sold'].to_numpy()
+
+    valid = products >= 0
+    product_qty, _ = bincount_sum(products[valid], qty[valid], n_products)
+    revenue = np.zeros(n_products)
+    if 'unit_price' in df.columns:
+        revenue, _ = bincount_sum(products[valid], (qty * df['unit_price'].to_numpy())[valid], n_products)
+    customer_counts = np.bincount(customers[customers >= 0], minlength=n_customers)
+
+    both = valid & (customers >= 0)
+    pairs, inverse = np.unique(customers[both] * n_products + products[both], return_inverse=True)
+    basket_qty, _ = bincount_sum(inverse, qty[both], len(pairs))
+
+    months, monthly, month_customers, offsets = [], np.zeros((0, n_products)), [], [0]
+    if sf.months is not None and not sf.months.empty:
+        rows = df.index.get_indexer(sf.months.index)
+        month_codes, months = pd.factorize(sf.months, sort=True)
+        keep = products[rows] >= 0
+        flat = month_codes[keep] * n_products + products[rows][keep]
+        monthly, _ = bincount_sum(flat, qty[rows][keep], len(months) * n_products)
+        monthly = monthly.reshape(len(months), n_products)
+        for m in range(len(months)):
+            codes = customers[rows][month_codes == m]
+            month_customers.append(np.unique(codes[codes >= 0]))
+            offsets.append(offsets[-1] + len(month_customers[-1]))
+    return {
+        "product_quantity": product_qty.astype('int64'),
+        "product_revenue": revenue,
+        "customer_counts": customer_counts.astype('int64'),
+        "months": np.asarray(list(months), dtype=str),
+        "monthly_quantity": monthly.astype('int64'),
+        "month_customers": np.concatenate(month_customers) if month_customers else np.zeros(0, 'int64'),
+        "month_offsets": np.asarray(offsets, dtype='int64'),
+        "basket_customers": pairs // max(n_products, 1),
+        "basket_products": pairs % max(n_products, 1),
+        "basket_quantity": basket_qty.astype('int64'),
+    }
+
+class CodedHistory:
+    # A shop's uploads merged through the symbol table. Each upload is
+    # encoded once and cached as .npz next to the store (keyed by its
+    # content hash); merging is array addition, and joins across months
+    # (repeat customers, cohorts) are sorted-array intersections.
+    def __init__(self, folder, entries=None):
+        self.folder = folder
+        self.table = SymbolTable(folder)
+        self.coded, self.uploads = [], []     # uploads: (file, sha256) per coded upload
+        for entry in entries if entries is not None else UploadStore(folder).sync():
+            if "error" not in entry:
+                self.coded.append(self._load(entry))
+                self.uploads.append((entry["file"], entry["sha256"]))
+        n_products, n_customers = self.table.size("product"), self.table.size("customer_id")
+        self.product_quantity = sum((_pad(c["product_quantity"], n_products) for c in self.coded),
+                                    np.zeros(n_products, 'int64'))
+        self.product_revenue = sum((_pad(c["product_revenue"], n_products) for c in self.coded),
+                                   np.zeros(n_products))
+        self.customer_counts = sum((_pad(c["customer_counts"], n_customers) for c in self.coded),
+                                   np.zeros(n_customers, 'int64'))
+        self.monthly_quantity = {}   # month -> product quantity vector
+        self.month_customers = {}    # month -> sorted customer codes
+        for c in self.coded:
+            for i, month in enumerate(map(str, c["months"])):
+                self.monthly_quantity[month] = self.monthly_quantity.get(month, 0) + \
+                    _pad(c["monthly_quantity"][i], n_products)
+                codes = c["month_customers"][c["month_offsets"][i]:c["month_offsets"][i + 1]]
+                seen = self.month_customers.get(month)
+                self.month_customers[month] = codes if seen is None else np.union1d(seen, codes)
+        self.months = sorted(self.month_customers)
+
+    def _load(self, entry):
+        codes_dir = state_path(self.folder, CODES_DIR)
+        os.makedirs(codes_dir, exist_ok=True)
+        path = os.path.join(codes_dir, entry["file"] + ".npz")
+        try:
+            with np.load(path) as data:
+                if str(data["sha256"]) == entry["sha256"] and int(data["version"]) == CODED_VERSION:
+                    coded = {k: data[k] for k in data.files}
+                    # Reload the table if another process added names since
+                    if len(coded["product_quantity"]) > self.table.size("product") or \
+                            len(coded["customer_counts"]) > self.table.size("customer_id"):
+                        self.table = SymbolTable(self.folder)
+                    return coded
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            pass    # missing, or left unreadable by an older non-atomic write
+        sf = load_upload(os.path.join(self.folder, entry["file"]), self.folder)
+        with self.table.locked():
+            coded = encode_upload(sf, self.table)
+        # Written under a per-process temp name and renamed into place, so a
+        # reader never opens a half-written file
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, sha256=entry["sha256"], version=CODED_VERSION, **coded)
+        os.replace(tmp, path)
+        return coded
+
+    # ------------------------------
+    # Views
+    # ------------------------------
+    def top(self, kind, n):
+        values = self.product_quantity if kind == "product" else self.customer_counts
+        if not len(values):
+            return []
+        order = np.lexsort((np.arange(len(values)), -values))[:n]
+        order = order[values[order] > 0]
+        return list(zip(self.table.decode(kind, order), values[order].tolist()))
+
+    def customer_overlap(self, months):
+        # Customers active in both months, for every pair of months
+        sets = [self.month_customers.get(m, np.zeros(0, 'int64')) for m in months]
+        return [[int(len(np.intersect1d(a, b, assume_unique=True))) for b in sets] for a in sets]
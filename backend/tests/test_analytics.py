@@ -0,0 +1,31 @@
+from analytics import DAYS_PER_MONTH, SalesHistory
+
+def _history():
+    # Sales in January and April only; March's upload has stock but no sales
+    jan = {"file": "2024-01-31_10-00-00.parquet",
+           "monthly_product_quantity": {"2024-01": {"Tea": 90, "Soap": 10}}}
+    apr = {"file": "2024-04-30_10-00-00.parquet",
+           "monthly_product_quantity": {"2024-04": {"Tea": 30}},
+           "latest_stock": {"Tea": {"date": "2024-04-30", "stock": 61}}}
+    return SalesHistory([jan, apr])
+
+def test_growth_zero_fills_missing_months():
+    growth = _history().growth(months=6)
+    assert growth["months"] == ["2024-01", "2024-02", "2024-03", "2024-04"]
+    assert [t["quantity"] for t in growth["trend"]] == [100, 0, 0, 30]
+    assert [t["change_pct"] for t in growth["trend"]] == [None, -100.0, None, None]
+    # April is compared with an empty March, not with January
+    assert growth["movers"]["rising"] == [{"product": "Tea", "change": 30}]
+    assert growth["movers"]["falling"] == []
+
+def test_stock_velocity_counts_months_without_sales():
+    velocity = _history().stock_velocity(months=3)
+    assert velocity["months"] == ["2024-02", "2024-03", "2024-04"]
+    tea, = velocity["products"]
+    assert tea["units_per_day"] == round(30 / (3 * DAYS_PER_MONTH), 2)
+    assert tea["days_of_cover"] == round(61 / (30 / (3 * DAYS_PER_MONTH)), 1)
+
+def test_window_starts_at_first_sale():
+    history = _history()
+    assert history.calendar(12) == ["2024-01", "2024-02", "2024-03", "2024-04"]
+    assert SalesHistory([]).calendar() == []
@@ -0,0 +1,42 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from batch_forecast import fit_holt, fit_ses, series_matrix
+
+statsmodels = pytest.importorskip("statsmodels.tsa.holtwinters")
+
+# Relative in-sample SSE the grid search may lose against statsmodels' optimiser
+SSE_TOLERANCE = 0.01
+
+@pytest.fixture(scope="module")
+def series():
+    rng = np.random.default_rng(7)
+    return [list(rng.poisson(rng.uniform(20, 500), size=rng.integers(4, 25)).astype(float))
+            for _ in range(200)]
+
+def _worst_gap(series, fit, model):
+    # Positive means statsmodels found a lower in-sample SSE than the grid search
+    worst = 0.0
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for i, s in enumerate(series):
+            ref = model(s, initialization_method="estimated").fit()
+            worst = max(worst, (fit["sse"][i] - ref.sse) / max(ref.sse, 1.0))
+    return worst
+
+def test_ses_matches_statsmodels(series):
+    fit = fit_ses(*series_matrix(series))
+    assert _worst_gap(series, fit, statsmodels.SimpleExpSmoothing) <= SSE_TOLERANCE
+
+def test_holt_matches_statsmodels(series):
+    fit = fit_holt(*series_matrix(series))
+    assert _worst_gap(series, fit, statsmodels.Holt) <= SSE_TOLERANCE
+
+def test_ragged_rows_match_single_fits(series):
+    together = fit_ses(*series_matrix(series[:20]))
+    for i, s in enumerate(series[:20]):
+        alone = fit_ses(*series_matrix([s]))
+        assert together["sse"][i] == pytest.approx(alone["sse"][0])
+        assert together["forecast"][i] == pytest.approx(alone["forecast"][0])
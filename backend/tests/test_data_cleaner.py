@@ -0,0 +1,52 @@
+import io
+
+import pandas as pd
+
+import data_cleaner
+from biz_insights import generate_insights
+from data_cleaner import clean_dataframe
+from streaming import stream_insights
+
+def _csv(df):
+    buf = io.StringIO()
+    df.to_csv(buf, index=False)
+    buf.seek(0)
+    return buf
+
+def _blank_cells():
+    # Customer C1 buys most often, but more rows still have no customer
+    # (and some no product) than C1 has purchases
+    rows = [("2024-01-05", "Tea", 2, "C1", 9)] * 4 + [("2024-01-06", "Soap", 1, "C2", 3)] * 2 \
+        + [("2024-01-07", "Tea", 1, None, 9)] * 6 + [("2024-01-08", None, 5, "C2", 2)] * 3
+    return pd.DataFrame(rows, columns=["date", "product", "quantity_sold", "customer_id", "stock_left"])
+
+def test_blank_names_stay_missing():
+    df = clean_dataframe(_blank_cells())
+    assert df['customer_id'].isna().sum() == 6
+    assert df['product'].isna().sum() == 3
+    assert 'nan' not in df['customer_id'].cat.categories
+
+def test_blank_names_are_not_ranked():
+    insights = generate_insights(_blank_cells())
+    assert insights['frequent_customers'] == {"C2": 5, "C1": 4}
+    assert insights['top_selling_products'] == {"Tea": 14, "Soap": 2}
+    assert insights['low_stock_alerts'] == ["Soap"]
+
+def test_streaming_matches_with_blank_names():
+    expected = generate_insights(_blank_cells())
+    assert stream_insights(_csv(_blank_cells()), chunksize=4) == expected
+
+def _dated(dates):
+    return pd.DataFrame({"date": dates, "product": ["Tea"] * len(dates),
+                         "quantity_sold": [1] * len(dates), "customer_id": ["C1"] * len(dates),
+                         "stock_left": [9] * len(dates)})
+
+def test_date_format_is_guessed_per_file(monkeypatch):
+    # Same headers, no user folder: a day-first file must not fix the format
+    # used for a later month-first one (whose dates parse either way)
+    monkeypatch.setattr(data_cleaner, "_SCHEMA_MEMO", {})
+    day_first = _dated(["13/03/2024", "20/03/2024"])
+    month_first = _dated(["02/03/2024", "02/05/2024"])
+    assert generate_insights(day_first)['monthly_sales_trend'] == {"2024-03": 2}
+    assert generate_insights(month_first.copy())['monthly_sales_trend'] == {"2024-02": 2}
+    assert stream_insights(_csv(month_first), chunksize=1)['monthly_sales_trend'] == {"2024-02": 2}
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import forecaster
+from forecaster import FIT_KEYS, ProductForecaster
+
+MONTHS = [f"2023-{m:02d}" for m in range(1, 11)]
+
+def _uploads():
+    # One upload per month; "New" first sells in the newest month and
+    # "Gappy" skips months, so its series is zero-filled
+    rng = np.random.default_rng(3)
+    uploads = []
+    for i, month in enumerate(MONTHS):
+        sales = {"Steady": int(rng.poisson(40)), "Rising": 10 + 6 * i + int(rng.poisson(3))}
+        if i % 3 == 0:
+            sales["Gappy"] = int(rng.poisson(25))
+        if month == MONTHS[-1]:
+            sales["New"] = 30
+        uploads.append({"file": f"{month}-28_10-00-00.parquet", "sha256": f"sha-{month}",
+                        "monthly_product_quantity": {month: sales}})
+    return uploads
+
+def _states(folder, uploads, one_at_a_time):
+    fc = ProductForecaster(str(folder))
+    for k in range(1, len(uploads) + 1) if one_at_a_time else [len(uploads)]:
+        fc.update(uploads[:k])
+    return fc
+
+def _assert_same_fit(a, b):
+    for key in FIT_KEYS:
+        assert a[key] == pytest.approx(b[key], rel=1e-9, abs=1e-9), key
+
+def test_one_upload_at_a_time_matches_full_refit(tmp_path, monkeypatch):
+    # With a refit on every new month, the incremental path must land on
+    # exactly the state of one refit over all uploads
+    monkeypatch.setattr(forecaster, "REFIT_EVERY", 1)
+    uploads = _uploads()
+    incremental = _states(tmp_path / "incremental", uploads, True)
+    full = _states(tmp_path / "full", uploads, False)
+
+    assert set(incremental.products) == set(full.products) == {"Steady", "Rising", "Gappy", "New"}
+    for product, state in full.products.items():
+        assert incremental.products[product]["series"] == state["series"]
+        _assert_same_fit(incremental.products[product], state)
+    assert incremental.predictions() == full.predictions()
+
+def test_cheap_updates_refit_new_products(tmp_path):
+    # Between refits other products take O(1) level updates, but a product
+    # first seen in the newest month is always fitted over the full calendar
+    uploads = _uploads()
+    incremental = _states(tmp_path / "incremental", uploads, True)
+    full = _states(tmp_path / "full", uploads, False)
+
+    new = incremental.products["New"]
+    assert new["updates"] == 0 and new["fitted_through"] == MONTHS[-1]
+    _assert_same_fit(new, full.products["New"])
+    assert incremental.predictions()["New"] == full.predictions()["New"]
+    for state in incremental.products.values():
+        assert state["fitted_through"] == MONTHS[-1]
+        assert state["updates"] < forecaster.REFIT_EVERY
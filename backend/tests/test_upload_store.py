@@ -0,0 +1,97 @@
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from streaming import iter_clean_chunks
+from upload_store import (PARTIAL_FIELDS, STORE_FILE, UploadStore, UploadWriter, load_upload,
+                          partials_path, state_path, valid_phone)
+
+def _csv(rows):
+    buf = io.StringIO()
+    pd.DataFrame(rows).to_csv(buf, index=False)
+    buf.seek(0)
+    return buf
+
+def test_chunks_with_rising_cardinality(tmp_path):
+    # 50 customers and small quantities in the first chunk, then 5000
+    # customers and quantities past int32 in the second
+    n = 1000
+    first = {"date": "2024-01-05", "product": [f"P{i % 10}" for i in range(n)],
+             "quantity_sold": np.arange(n) % 7 + 1, "customer_id": [f"C{i % 50}" for i in range(n)],
+             "stock_left": 10}
+    second = {"date": "2024-02-05", "product": [f"Q{i}" for i in range(n)],
+              "quantity_sold": np.full(n, 2 ** 33), "customer_id": [f"D{i * 5}" for i in range(n)],
+              "stock_left": 10}
+    path = str(tmp_path / "upload.parquet")
+
+    source = _csv(pd.concat([pd.DataFrame(first), pd.DataFrame(second)]))
+    with UploadWriter(path) as writer:
+        chunks = 0
+        for df, _ in iter_clean_chunks(source, chunksize=n):
+            writer.write(df)
+            chunks += 1
+    assert chunks == 2
+
+    assert pq.ParquetFile(path).metadata.num_row_groups == 2
+    df = load_upload(path).df
+    assert len(df) == 2 * n
+    assert df['customer_id'].nunique() == 50 + n
+    assert df['product'].nunique() == 10 + n
+    assert int(df['quantity_sold'].max()) == 2 ** 33
+
+def test_extra_columns_change_type_between_chunks(tmp_path):
+    # "notes" is blank and "batch" numeric in the first chunk, both text in
+    # the second; unit_price is whole rupees first, then paise
+    n = 100
+    rows = {"date": "2024-01-05", "product": "Tea", "quantity_sold": 1,
+            "customer_id": [f"C{i}" for i in range(2 * n)], "stock_left": 10,
+            "unit_price": [10] * n + [12.5] * n,
+            "notes": [None] * n + ["gift"] * n, "batch": [7] * n + ["B-7"] * n}
+    path = str(tmp_path / "upload.parquet")
+
+    with UploadWriter(path) as writer:
+        for df, _ in iter_clean_chunks(_csv(rows), chunksize=n):
+            writer.write(df)
+
+    df = load_upload(path).df
+    assert len(df) == 2 * n
+    assert pd.isna(df['notes'].iloc[0])
+    assert df['notes'].iloc[-1] == "gift"
+    assert list(df['batch'].iloc[[0, -1]]) == ["7", "B-7"]
+    assert list(df['unit_price'].iloc[[0, -1]]) == [10.0, 12.5]
+
+def test_partials_live_beside_the_index(tmp_path):
+    # Per-month partials go to one side file per upload and are read back
+    # only by the views that merge them
+    from analytics import SalesHistory
+
+    folder = str(tmp_path)
+    rows = {"date": ["2024-01-05", "2024-02-05"], "product": "Tea", "quantity_sold": 3,
+            "customer_id": ["C1", "C2"], "stock_left": 10}
+    with UploadWriter(os.path.join(folder, "2024-02-06_10-00-00.parquet")) as writer:
+        for df, _ in iter_clean_chunks(_csv(rows)):
+            writer.write(df)
+
+    entry, = UploadStore(folder).sync()
+    with open(state_path(folder, STORE_FILE)) as f:
+        index = json.load(f)["files"]["2024-02-06_10-00-00.parquet"]
+    assert not set(PARTIAL_FIELDS) & set(index)
+    assert index["sales_months"] == ["2024-01", "2024-02"]
+
+    history = SalesHistory.for_user(folder)
+    assert history.products == {"2024-01": {"Tea": 3}, "2024-02": {"Tea": 3}}
+    assert history.customers == {"2024-01": {"C1": 1}, "2024-02": {"C2": 1}}
+    assert history.stock == {"Tea": {"date": "2024-02-05", "stock": 10}}
+
+    os.remove(os.path.join(folder, entry["file"]))
+    assert UploadStore(folder).sync() == []
+    assert not os.path.exists(partials_path(folder, entry["file"]))
+
+def test_valid_phone_takes_the_whole_string():
+    assert valid_phone("+919205973090") and valid_phone("9000000031")
+    for phone in ("9000000031\n", "9000000031/..", "../9000000031", "12345", "", None):
+        assert not valid_phone(phone)
@@ -0,0 +1,83 @@
+import sqlite3
+import time
+
+import pytest
+
+import whatsapp_queue
+from whatsapp_queue import DeliveryQueue, DeliveryWorker, FakeTwilioClient, RateLimiter
+
+def _worker(tmp_path, client, lease=whatsapp_queue.SENDING_LEASE):
+    queue = DeliveryQueue(str(tmp_path / "queue.db"), lease=lease)
+    return DeliveryWorker(client, "whatsapp:+10000000000", queue=queue, limiter=RateLimiter(1000))
+
+def test_enqueue_claim_send_status(tmp_path):
+    client = FakeTwilioClient()
+    worker = _worker(tmp_path, client)
+    message_id = worker.queue.enqueue("+919000000001", "hello")
+    assert worker.queue.get(message_id)["status"] == "queued"
+
+    worker.drain()
+    message = worker.queue.get(message_id)
+    assert message["status"] == "sent" and message["attempts"] == 1
+    assert message["sid"] == client.sent[0]["sid"]
+    assert client.sent[0]["to"] == "whatsapp:+919000000001"
+    assert worker.queue.claim() == []
+
+def test_client_errors_back_off_then_fail(tmp_path, monkeypatch):
+    worker = _worker(tmp_path, FakeTwilioClient(fail_times=1))
+    message_id = worker.queue.enqueue("+919000000002", "hello")
+
+    worker.drain()
+    message = worker.queue.get(message_id)
+    assert message["status"] == "queued" and message["attempts"] == 1
+    assert "Fake Twilio failure" in message["last_error"]
+    assert worker.queue.claim() == []    # not due until the backoff passes
+
+    worker.queue.mark_retry(message_id, "retry now", 0)
+    worker.drain()
+    assert worker.queue.get(message_id)["status"] == "sent"
+
+    # Without backoff, drain retries until the message runs out of attempts
+    monkeypatch.setattr(whatsapp_queue, "backoff_delay", lambda attempts: 0)
+    failing = _worker(tmp_path, FakeTwilioClient(failure_rate=1.0))
+    message_id = failing.queue.enqueue("+919000000003", "hello")
+    failing.drain()
+    message = failing.queue.get(message_id)
+    assert message["status"] == "failed" and message["attempts"] == whatsapp_queue.MAX_ATTEMPTS
+
+def test_stale_claims_are_requeued(tmp_path):
+    queue = DeliveryQueue(str(tmp_path / "queue.db"))
+    message_id = queue.enqueue("+919000000004", "hello")
+    assert [m["id"] for m in queue.claim()] == [message_id]
+
+    # A live claim is left alone, by a new process and by other claims
+    assert DeliveryQueue(queue.path).requeue_stale() == 0
+    assert queue.claim() == []
+
+    time.sleep(0.05)
+    expired = DeliveryQueue(queue.path, lease=0.01)
+    assert queue.get(message_id)["status"] == "queued"
+    assert [m["id"] for m in expired.claim()] == [message_id]
+
+def test_send_is_not_repeated_when_mark_sent_fails(tmp_path, monkeypatch):
+    client = FakeTwilioClient()
+    worker = _worker(tmp_path, client, lease=0)
+    message_id = worker.queue.enqueue("+919000000005", "hello")
+    mark_sent = worker.queue.mark_sent
+
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(worker.queue, "mark_sent", locked)
+    message, = worker.queue.claim()
+    with pytest.raises(sqlite3.OperationalError):
+        worker.deliver(message)
+    assert worker.queue.get(message_id)["status"] == "sending"
+
+    # Its lease ran out, so it is claimed again, but not sent again
+    monkeypatch.setattr(worker.queue, "mark_sent", mark_sent)
+    message, = worker.queue.claim()
+    worker.deliver(message)
+    assert len(client.sent) == 1
+    message = worker.queue.get(message_id)
+    assert message["status"] == "sent" and message["sid"] == client.sent[0]["sid"]
@@ -0,0 +1,337 @@
+import os
+import re
+import json
+import hashlib
+import pandas as pd
+
+from data_cleaner import CATEGORY_FIELDS, FIELDS
+from sales_frame import SalesFrame, SalesAggregates
+from biz_insights import insights_from_aggregates, generate_personalized_advice
+
+# ------------------------------
+# Layout
+# ------------------------------
+# data/<phone>/<timestamp>.parquet   cleaned uploads (typed, columnar)
+# data/<phone>/<timestamp>.csv       legacy cleaned uploads, still readable
+# data/<phone>/.vyapaar/...          derived per-user state, safe to delete
+# data/<phone>/.vyapaar/aggregates.json              small per-upload index
+# data/<phone>/.vyapaar/partials/<upload>.json       per-month partials of one upload
+DATA_DIR = "data"
+STATE_DIR = ".vyapaar"
+STORE_FILE = "aggregates.json"
+STORE_VERSION = 6
+PARTIALS_DIR = "partials"
+# Per-month product and customer partials grow with the shop, so they are
+# kept out of the index and only read by the views that merge them
+PARTIAL_FIELDS = ("monthly_product_quantity", "monthly_customer_counts", "latest_stock")
+UPLOAD_FORMAT = ".parquet"
+UPLOAD_EXTENSIONS = (".parquet", ".csv")
+CATEGORY_COLUMNS = tuple(CATEGORY_FIELDS)
+PHONE_PATTERN = re.compile(r"\+?\d{6,15}")
+
+def valid_phone(phone):
+    # The whole string, so a path or a trailing newline never reaches user_folder
+    return bool(phone) and PHONE_PATTERN.fullmatch(phone) is not None
+
+def user_folder(phone):
+    return os.path.join(DATA_DIR, phone)
+
+def state_path(folder, name):
+    state_dir = os.path.join(folder, STATE_DIR)
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, name)
+
+def partials_path(folder, filename):
+    partials_dir = state_path(folder, PARTIALS_DIR)
+    os.makedirs(partials_dir, exist_ok=True)
+    return os.path.join(partials_dir, f"{filename}.json")
+
+def list_uploads(folder):
+    if not os.path.isdir(folder):
+        return []
+    return sorted(
+        f for f in os.listdir(folder)
+        if not f.startswith('.') and f.endswith(UPLOAD_EXTENSIONS)
+        and os.path.isfile(os.path.join(folder, f))
+    )
+
+def new_upload_name(timestamp):
+    return f"{timestamp}{UPLOAD_FORMAT}"
+
+def read_upload(path):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+def load_upload(path, folder=None):
+    # Parquet uploads were cleaned before being written and keep their dtypes,
+    # so only legacy CSVs go through the cleaner again.
+    df = read_upload(path)
+    if path.endswith(".parquet"):
+        # Cleaner version 2 stored missing names as the text 'nan'
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype) \
+                    and 'nan' in df[col].cat.categories:
+                df[col] = df[col].cat.remove_categories(['nan'])
+        return SalesFrame(df, {col: col for col in df.columns})
+    return SalesFrame.from_raw(df, folder)
+
+# ------------------------------
+# Columnar writer
+# ------------------------------
+def to_storage_frame(df):
+    # Low-cardinality text columns become categoricals (dictionary-encoded in
+    # Parquet); cleaned numeric and datetime columns are kept as they are.
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+def storage_schema(schema):
+    # Widest per-column types, so every chunk of an upload fits the schema
+    # of its first one: the cleaner picks int8 category codes or int32
+    # integers per chunk, and a later chunk may need more. Columns the
+    # cleaner does not type are stored as text, since a column that is blank
+    # (float NaN) or numeric in the first chunk may hold text later.
+    import pyarrow as pa
+
+    fields = []
+    for field in schema:
+        if field.name not in FIELDS:
+            field = field.with_type(pa.string())
+        elif pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif field.name == 'unit_price':
+            field = field.with_type(pa.float64())
+        elif pa.types.is_integer(field.type):
+            field = field.with_type(pa.int64())
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+class UploadWriter:
+    # Appends cleaned chunks to one Parquet file as separate row groups
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+
+    def write(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(to_storage_frame(df), preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, storage_schema(table.schema), compression="zstd")
+        table = table.cast(self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        if exc_type is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        return False
+
+def write_upload(df, path):
+    with UploadWriter(path) as writer:
+        writer.write(df)
+
+# ------------------------------
+# CSV -> Parquet migration
+# ------------------------------
+def migrate_folder(folder):
+    # Rewrites every legacy CSV upload as Parquet under the same timestamp and
+    # removes the CSV once the row counts match. Returns the migrated names.
+    migrated = []
+    for filename in list_uploads(folder):
+        if not filename.endswith(".csv"):
+            continue
+        src = os.path.join(folder, filename)
+        dst = os.path.join(folder, filename[:-len(".csv")] + UPLOAD_FORMAT)
+        if os.path.exists(dst):
+            continue
+        sf = load_upload(src)
+        write_upload(sf.df, dst)
+        if len(pd.read_parquet(dst, columns=[sf.df.columns[0]])) != len(sf.df):
+            os.remove(dst)
+            raise ValueError(f"Row count mismatch while migrating {src}")
+        os.remove(src)
+        migrated.append(filename)
+    return migrated
+
+def migrate_all(data_dir=DATA_DIR):
+    results = {}
+    for phone in sorted(os.listdir(data_dir)):
+        folder = os.path.join(data_dir, phone)
+        if os.path.isdir(folder) and not phone.startswith('.'):
+            results[phone] = migrate_folder(folder)
+    return results
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def write_json_atomic(path, data):
+    # Per-process temp name: batch workers may write the same file at once
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+# ------------------------------
+# Per-upload summary
+# ------------------------------
+def summarize_upload(sf):
+    # sf: a SalesFrame or a streaming.StreamingAggregator
+    agg = sf.aggregates
+    insights = insights_from_aggregates(agg)
+    return {
+        "rows": int(sf.rows),
+        "date_range": list(sf.date_range) if sf.date_range else None,
+        "insights": insights,
+        "advice": generate_personalized_advice(insights),
+        "aggregates": agg.to_dict(),
+        "monthly_product_quantity": sf.monthly_product_quantity,
+        "monthly_customer_counts": sf.monthly_customer_counts,
+        "latest_stock": sf.latest_stock,
+        "sketches": sf.sketches,
+    }
+
+def load_partials(folder, entry):
+    # The entry with its per-month partials, read from the upload's side
+    # file. Entries that still carry them inline (a summary not stored yet)
+    # are returned as they are; a missing or outdated side file reads as
+    # no partials.
+    if folder is None or "error" in entry or any(field in entry for field in PARTIAL_FIELDS):
+        return entry
+    try:
+        with open(partials_path(folder, entry["file"])) as f:
+            partials = json.load(f)
+    except (OSError, ValueError):
+        partials = {}
+    if partials.get("sha256") != entry.get("sha256"):
+        partials = {}
+    return dict(entry, **{field: partials.get(field) for field in PARTIAL_FIELDS})
+
+# ------------------------------
+# Aggregate Store
+# ------------------------------
+class UploadStore:
+    # One JSON document per user, keyed by upload file name. Each entry keeps
+    # the file's content hash plus size/mtime so unchanged files are trusted
+    # without re-hashing, and changed or new files are re-analysed once.
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = state_path(folder, STORE_FILE)
+        self.entries = {}
+        self._dirty = False
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                if data.get("version") == STORE_VERSION:
+                    self.entries = data.get("files", {})
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def save(self):
+        write_json_atomic(self.path, {"version": STORE_VERSION, "files": self.entries})
+        self._dirty = False
+
+    def _stat(self, filename):
+        st = os.stat(os.path.join(self.folder, filename))
+        return st.st_size, st.st_mtime_ns
+
+    def add(self, filename, sf=None, save=True):
+        if sf is None:
+            sf = load_upload(os.path.join(self.folder, filename), self.folder)
+        return self.add_summary(filename, summarize_upload(sf), save)
+
+    def add_summary(self, filename, entry, save=True):
+        # entry: a summarize_upload() result, e.g. computed in another process.
+        # Its partials go to the upload's side file; the index keeps the rest.
+        from forecaster import upload_month_sales
+
+        path = os.path.join(self.folder, filename)
+        size, mtime = self._stat(filename)
+        entry = dict(entry, file=filename, sha256=file_hash(path), size=size, mtime_ns=mtime)
+        partials = {field: entry.pop(field, None) for field in PARTIAL_FIELDS}
+        entry["sales_months"] = sorted(upload_month_sales(dict(entry, **partials)))
+        write_json_atomic(partials_path(self.folder, filename), dict(partials, sha256=entry["sha256"]))
+        self.entries[filename] = entry
+        self._dirty = True
+        if save:
+            self.save()
+        return entry
+
+    def is_fresh(self, filename):
+        entry = self.entries.get(filename)
+        if entry is None:
+            return False
+        size, mtime = self._stat(filename)
+        if (size, mtime) == (entry.get("size"), entry.get("mtime_ns")):
+            return True
+        # Touched on disk: only re-analyse if the bytes actually changed
+        if file_hash(os.path.join(self.folder, filename)) == entry.get("sha256"):
+            entry["size"], entry["mtime_ns"] = size, mtime
+            self._dirty = True
+            return True
+        return False
+
+    def sync(self):
+        # Bring the store in line with the upload folder and return entries in
+        # upload order. Files that fail to parse get an entry with an "error"
+        # key, so they are not re-parsed until their content changes.
+        files = list_uploads(self.folder)
+
+        for stale in set(self.entries) - set(files):
+            del self.entries[stale]
+            self._dirty = True
+            try:
+                os.remove(partials_path(self.folder, stale))
+            except OSError:
+                pass
+
+        for filename in files:
+            try:
+                if not self.is_fresh(filename):
+                    self.add(filename, save=False)
+            except Exception as e:
+                path = os.path.join(self.folder, filename)
+                size, mtime = self._stat(filename)
+                self.entries[filename] = {"file": filename, "error": str(e), "sha256": file_hash(path),
+                                          "size": size, "mtime_ns": mtime}
+                self._dirty = True
+
+        if self._dirty:
+            self.save()
+        return [self.entries[f] for f in files]
+
+    def partials(self, filename):
+        return load_partials(self.folder, self.entries.get(filename) or {"file": filename})
+
+    def aggregates(self, filename):
+        entry = self.entries.get(filename)
+        if not entry or "aggregates" not in entry:
+            return None
+        return SalesAggregates.from_dict(entry["aggregates"])
+
+# ------------------------------
+# CLI: python upload_store.py migrate [data_dir]
+# ------------------------------
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        sys.exit("usage: python upload_store.py migrate [data_dir]")
+    for phone, files in migrate_all(sys.argv[2] if len(sys.argv) > 2 else DATA_DIR).items():
+        print(f"{phone}: migrated {len(files)} file(s)")
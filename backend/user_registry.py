@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+
+# ------------------------------
+# Config
+# ------------------------------
+REGISTRY_DB = os.getenv("USER_REGISTRY_DB", "users.db")
+LEGACY_USER_DB = "users.json"
+
+# ------------------------------
+# User Registry (SQLite, WAL)
+# ------------------------------
+class UserRegistry:
+    # Phone is the primary key, so lookups are a single index probe and
+    # registration is one atomic upsert; concurrent Streamlit sessions and
+    # bulk jobs share the same file safely.
+    def __init__(self, path=REGISTRY_DB, legacy_json=LEGACY_USER_DB):
+        self.path = path
+        with self._connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    phone TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            empty = db.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+        if empty and legacy_json and os.path.exists(legacy_json):
+            self.import_json(legacy_json)
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            yield db
+        finally:
+            db.close()
+
+    def get(self, phone):
+        with self._connect() as db:
+            row = db.execute("SELECT name FROM users WHERE phone = ?", (phone,)).fetchone()
+        return {"name": row[0]} if row else None
+
+    def upsert(self, phone, name):
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO users (phone, name, created_at, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(phone) DO UPDATE SET name = excluded.name, updated_at = excluded.updated_at",
+                (phone, name, now, now),
+            )
+
+    def upsert_many(self, users):
+        # users: {phone: {"name": ...}}, written in one transaction
+        now = time.time()
+        rows = [(phone, info.get("name", ""), now, now) for phone, info in users.items()]
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany(
+                    "INSERT INTO users (phone, name, created_at, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(phone) DO UPDATE SET name = excluded.name, updated_at = excluded.updated_at",
+                    rows,
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def import_json(self, path=LEGACY_USER_DB):
+        with open(path) as f:
+            return self.upsert_many(json.load(f))
+
+    def all(self):
+        with self._connect() as db:
+            rows = db.execute("SELECT phone, name FROM users ORDER BY phone").fetchall()
+        return {phone: {"name": name} for phone, name in rows}
+
+    def __len__(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+# ------------------------------
+# CLI: python user_registry.py import [users.json]
+# ------------------------------
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2 or sys.argv[1] != "import":
+        sys.exit("usage: python user_registry.py import [users.json]")
+    count = UserRegistry(legacy_json=None).import_json(sys.argv[2] if len(sys.argv) > 2 else LEGACY_USER_DB)
+    print(f"Imported {count} user(s) into {REGISTRY_DB}")
@@ -0,0 +1,401 @@
+import os
+import time
+import asyncio
+import uuid
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from upload_store import DATA_DIR, state_path
+from metrics import inc, observe
+
+# ------------------------------
+# Config
+# ------------------------------
+QUEUE_DB = os.getenv("WHATSAPP_QUEUE_DB")    # default: data/.vyapaar/whatsapp_queue.db
+WORKERS = int(os.getenv("WHATSAPP_WORKERS", "4"))
+RATE_PER_SEC = float(os.getenv("WHATSAPP_RATE_PER_SEC", "10"))
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2.0      # seconds; doubles per attempt
+BACKOFF_MAX = 300.0
+POLL_INTERVAL = 0.5
+QUEUE_RETRY_MAX = 30.0  # seconds; longest pause after queue database errors
+# A "sending" claim older than this is taken to belong to a dead worker.
+# Must exceed the time a worker needs for one batch at its send rate.
+SENDING_LEASE = float(os.getenv("WHATSAPP_SENDING_LEASE", "300"))     # seconds
+
+# ------------------------------
+# Durable Queue (SQLite)
+# ------------------------------
+class DeliveryQueue:
+    # Messages survive restarts. A claim is a lease: "sending" rows carry
+    # their claim time in updated_at, and only claims older than
+    # SENDING_LEASE are put back to "queued", so a process starting next to
+    # live siblings (pre-fork or multi-worker uvicorn) never re-sends what
+    # they are still sending. Delivery is at-least-once: a worker that dies
+    # between the provider accepting a message and mark_sent leaves a claim
+    # that is sent again once its lease expires.
+    def __init__(self, path=None, lease=SENDING_LEASE):
+        self.lease = lease
+        self.path = path or QUEUE_DB or state_path(DATA_DIR, "whatsapp_queue.db")
+        with self._connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id TEXT PRIMARY KEY,
+                    phone TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    sid TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_due ON messages (status, next_attempt_at)")
+        self.requeue_stale()
+
+    def requeue_stale(self):
+        # Returns how many expired claims went back to "queued"
+        with self._connect() as db:
+            return db.execute(
+                "UPDATE messages SET status = 'queued', updated_at = ? "
+                "WHERE status = 'sending' AND updated_at < ?",
+                (time.time(), time.time() - self.lease),
+            ).rowcount
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.row_factory = sqlite3.Row
+            yield db
+        finally:
+            db.close()
+
+    def enqueue(self, phone, body):
+        message_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO messages (id, phone, body, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (message_id, phone, body, now, now, now),
+            )
+        return message_id
+
+    def get(self, message_id):
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT id, phone, status, attempts, last_error, sid, created_at, updated_at "
+                "FROM messages WHERE id = ?", (message_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, limit=BATCH_SIZE):
+        # Atomically move up to `limit` due messages to "sending", including
+        # claims whose lease ran out (their worker died mid-batch)
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    "SELECT id, phone, body, attempts FROM messages "
+                    "WHERE (status = 'queued' AND next_attempt_at <= ?) "
+                    "OR (status = 'sending' AND updated_at < ?) ORDER BY next_attempt_at LIMIT ?",
+                    (now, now - self.lease, limit),
+                ).fetchall()
+                db.executemany(
+                    "UPDATE messages SET status = 'sending', updated_at = ? WHERE id = ?",
+                    [(now, row["id"]) for row in rows],
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return [dict(row) for row in rows]
+
+    def mark_sent(self, message_id, sid=None):
+        self._update(message_id, "status = 'sent', sid = ?, attempts = attempts + 1", (sid,))
+
+    def mark_retry(self, message_id, error, delay):
+        self._update(message_id, "status = 'queued', last_error = ?, attempts = attempts + 1, "
+                                 "next_attempt_at = ?", (error, time.time() + delay))
+
+    def mark_failed(self, message_id, error):
+        self._update(message_id, "status = 'failed', last_error = ?, attempts = attempts + 1", (error,))
+
+    def _update(self, message_id, assignments, params):
+        with self._connect() as db:
+            db.execute(f"UPDATE messages SET {assignments}, updated_at = ? WHERE id = ?",
+                       (*params, time.time(), message_id))
+
+    def counts(self):
+        with self._connect() as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM messages GROUP BY status").fetchall())
+
+# ------------------------------
+# Rate Limiter (token bucket)
+# ------------------------------
+class RateLimiter:
+    def __init__(self, rate_per_sec=RATE_PER_SEC, burst=None):
+        self.rate = rate_per_sec
+        self.capacity = burst or max(1.0, rate_per_sec)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self):
+        # Takes a token and returns 0, or returns the seconds until one is due
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+def backoff_delay(attempts):
+    # attempts already made -> seconds to wait, with jitter
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempts))
+    return delay * random.uniform(0.8, 1.2)
+
+# ------------------------------
+# Worker Pool
+# ------------------------------
+class DeliveryWorker:
+    def __init__(self, client, from_number, queue=None, workers=WORKERS, limiter=None):
+        self.client = client
+        self.from_number = from_number
+        self.queue = queue or DeliveryQueue()
+        self.workers = workers
+        self.limiter = limiter or RateLimiter()
+        self._stop = threading.Event()
+        self._threads = []
+        # {message id: provider sid} for sends whose mark_sent failed; they
+        # are recorded before the next claim and never sent again
+        self._unrecorded = {}
+        self._unrecorded_lock = threading.Lock()
+
+    def start(self):
+        if self._threads:
+            return self
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"whatsapp-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        # Queue errors (e.g. "database is locked" after the 30s busy timeout)
+        # pause the thread instead of ending it; anything left "sending" is
+        # picked up again once its lease expires
+        errors = 0
+        while not self._stop.is_set():
+            try:
+                self.record_sent()
+                batch = self.queue.claim(BATCH_SIZE)
+                if not batch:
+                    self._stop.wait(POLL_INTERVAL)
+                for message in batch:
+                    self.deliver(message)
+                errors = 0
+            except sqlite3.Error as e:
+                errors += 1
+                self._stop.wait(self._queue_error(e, errors))
+
+    def _queue_error(self, error, errors):
+        # Logs a queue database error and returns how long to back off
+        inc("whatsapp_queue_errors_total", error=type(error).__name__)
+        delay = min(QUEUE_RETRY_MAX, POLL_INTERVAL * (2 ** errors))
+        print(f"WhatsApp queue error ({error}); retrying in {delay:.1f}s")
+        return delay
+
+    def record_sent(self):
+        # Retries mark_sent for sends the queue failed to record
+        with self._unrecorded_lock:
+            pending = list(self._unrecorded.items())
+        for message_id, sid in pending:
+            self.queue.mark_sent(message_id, sid)
+            with self._unrecorded_lock:
+                self._unrecorded.pop(message_id, None)
+
+    def _already_sent(self, message):
+        # A message re-claimed after its send went through (see record_sent)
+        with self._unrecorded_lock:
+            if message["id"] not in self._unrecorded:
+                return False
+        self.record_sent()
+        return True
+
+    def deliver(self, message):
+        if self._already_sent(message):
+            return
+        self.limiter.acquire()
+        start = time.perf_counter()
+        try:
+            result = self.client.messages.create(
+                body=message["body"],
+                from_=self.from_number,
+                to=f"whatsapp:{message['phone']}"
+            )
+        except Exception as e:
+            self._failed(message, e, start)
+        else:
+            self._sent(message, result, start)
+
+    def _sent(self, message, result, start):
+        observe("twilio_send_seconds", time.perf_counter() - start, outcome="sent")
+        inc("twilio_messages_total", outcome="sent")
+        sid = getattr(result, "sid", None)
+        try:
+            self.queue.mark_sent(message["id"], sid)
+        except sqlite3.Error:
+            with self._unrecorded_lock:
+                self._unrecorded[message["id"]] = sid
+            raise
+
+    def _failed(self, message, error, start):
+        observe("twilio_send_seconds", time.perf_counter() - start, outcome="error")
+        inc("twilio_messages_total", outcome="error", error=type(error).__name__)
+        attempts = message["attempts"] + 1
+        if attempts >= MAX_ATTEMPTS:
+            self.queue.mark_failed(message["id"], str(error))
+        else:
+            self.queue.mark_retry(message["id"], str(error), backoff_delay(attempts - 1))
+
+    def drain(self, timeout=30):
+        # Process due messages on the calling thread until none are left
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            self.record_sent()
+            batch = self.queue.claim(BATCH_SIZE)
+            if not batch:
+                return
+            for message in batch:
+                self.deliver(message)
+
+# ------------------------------
+# Async worker (for the asyncio front, asgi_app.py)
+# ------------------------------
+class AsyncDeliveryWorker(DeliveryWorker):
+    # Same queue, rate limit, retries and metrics, driven by one event loop:
+    # up to `workers` sends are awaited at once instead of holding a thread
+    # each. Uses the client's create_async (Twilio's AsyncTwilioHttpClient)
+    # and falls back to a thread for clients without it.
+    def __init__(self, client, from_number, queue=None, workers=WORKERS, limiter=None):
+        super().__init__(client, from_number, queue, workers, limiter)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._stop.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run_async())
+        return self
+
+    async def stop_async(self):
+        self._stop.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run_async(self):
+        slots = asyncio.Semaphore(self.workers)
+
+        async def send(message):
+            async with slots:
+                await self.deliver_async(message)
+
+        errors = 0
+        while not self._stop.is_set():
+            try:
+                await asyncio.to_thread(self.record_sent)
+                batch = await asyncio.to_thread(self.queue.claim, BATCH_SIZE)
+                if not batch:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                # Let every send of the batch finish before handling an error
+                for result in await asyncio.gather(*(send(m) for m in batch), return_exceptions=True):
+                    if isinstance(result, BaseException):
+                        raise result
+                errors = 0
+            except sqlite3.Error as e:
+                errors += 1
+                await asyncio.sleep(self._queue_error(e, errors))
+
+    async def deliver_async(self, message):
+        if await asyncio.to_thread(self._already_sent, message):
+            return
+        await self.limiter.acquire_async()
+        start = time.perf_counter()
+        kwargs = {"body": message["body"], "from_": self.from_number, "to": f"whatsapp:{message['phone']}"}
+        try:
+            create_async = getattr(self.client.messages, "create_async", None)
+            if create_async is not None:
+                result = await create_async(**kwargs)
+            else:
+                result = await asyncio.to_thread(self.client.messages.create, **kwargs)
+        except Exception as e:
+            await asyncio.to_thread(self._failed, message, e, start)
+        else:
+            await asyncio.to_thread(self._sent, message, result, start)
+
+# ------------------------------
+# Fake Twilio client (local testing)
+# ------------------------------
+class FakeTwilioClient:
+    # Drop-in for twilio.rest.Client in tests and local runs
+    # (set TWILIO_FAKE=1 for app.py). Fails the first `fail_times` calls per
+    # recipient, or randomly with probability `failure_rate`.
+    def __init__(self, latency=0.0, failure_rate=0.0, fail_times=0):
+        self.messages = self
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_times = fail_times
+        self.sent = []
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def create(self, body, from_, to):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._record(body, from_, to)
+
+    async def create_async(self, body, from_, to):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._record(body, from_, to)
+
+    def _record(self, body, from_, to):
+        with self._lock:
+            failed = self._failures.get(to, 0)
+            if failed < self.fail_times or random.random() < self.failure_rate:
+                self._failures[to] = failed + 1
+                raise RuntimeError(f"Fake Twilio failure for {to}")
+            sid = f"SM{uuid.uuid4().hex}"
+            self.sent.append({"sid": sid, "body": body, "from_": from_, "to": to})
+        return type("FakeMessage", (), {"sid": sid})()
@@ -0,0 +1,7 @@
+# WSGI entry point for production servers, e.g.:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+from app import create_app
+
+# Built once in the master when preloading; delivery threads are started
+# per worker by gunicorn.conf.py's post_fork hook.
+app = create_app(start_workers=False)